@@ -0,0 +1,114 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from .models import Profile
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+
+class LastSeenTracker:
+    """Buffer login and activity timestamps in memory and write them in bulk.
+
+    Every authenticated request, login and WebSocket message would otherwise
+    cost a row update. Timestamps are kept per user (latest wins) and a
+    background thread flushes them every ``LAST_SEEN_FLUSH_INTERVAL`` seconds
+    with one ``UPDATE ... CASE`` statement per batch, so quiet workers still
+    write and requests never wait on a flush. An interval of ``0`` writes
+    through on every touch.
+    """
+
+    batch_size = 500
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._logins = {}
+        self._seen = {}
+        self._thread_pid = None
+
+    @property
+    def interval(self) -> float:
+        return getattr(settings, 'LAST_SEEN_FLUSH_INTERVAL', 30)
+
+    def touch(self, user_id: int, when=None, login: bool = False):
+        """Record activity for ``user_id``; the flush thread writes it later.
+
+        With an interval of ``0`` the write happens here, so call it from sync code.
+        """
+        when = when or timezone.now()
+        with self._lock:
+            self._seen[user_id] = when
+            if login:
+                self._logins[user_id] = when
+            start = bool(self.interval) and self._thread_pid != os.getpid()
+            if start:
+                self._thread_pid = os.getpid()
+        if not self.interval:
+            self.flush()
+        elif start:
+            threading.Thread(target=self._run, name='last-seen-flush', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval or 1)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not flush last-seen timestamps; retrying next interval')
+            finally:
+                connections.close_all()  # only this thread's connections
+
+    def flush(self):
+        """Write all buffered timestamps to the database.
+
+        If the write fails the timestamps go back into the buffer, unless a
+        newer one arrived meanwhile.
+        """
+        with self._lock:
+            logins, self._logins = self._logins, {}
+            seen, self._seen = self._seen, {}
+        try:
+            self._bulk_update(User.objects.all(), 'id', 'last_login', logins)
+            self._bulk_update(Profile.objects.all(), 'user_id', 'last_seen', seen)
+        except Exception:
+            with self._lock:
+                self._logins = {**logins, **self._logins}
+                self._seen = {**seen, **self._seen}
+            raise
+
+    def _bulk_update(self, queryset, key, field, values):
+        items = list(values.items())
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            whens = [When(**{key: user_id}, then=Value(ts)) for user_id, ts in batch]
+            queryset.filter(**{f'{key}__in': [user_id for user_id, _ in batch]}).update(
+                **{field: Case(*whens, output_field=DateTimeField())}
+            )
+
+
+last_seen = LastSeenTracker()
+
+
+def _flush_at_exit():
+    try:
+        last_seen.flush()
+    except Exception:  # pragma: no cover - database may already be gone
+        pass
+
+
+atexit.register(_flush_at_exit)
+
+
+def record_login(sender, request, user, **kwargs):
+    """Replacement for ``django.contrib.auth.models.update_last_login``."""
+    user.last_login = timezone.now()
+    last_seen.touch(user.pk, when=user.last_login, login=True)
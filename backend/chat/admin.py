@@ -1,7 +1,160 @@
+import json
+
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
 
 from .models import Chat, Message, Profile
 
+CURSOR_VAR = 'cursor'
+
+
+def estimate_count(queryset, exact_below=10000):
+    """Row count from the PostgreSQL planner, exact only when the estimate is small.
+
+    ``COUNT(*)`` has to visit every matching row, which is what makes admin
+    changelists time out on very large tables.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    estimate = int(plan[0]['Plan']['Plan Rows'])
+    return queryset.count() if estimate < exact_below else estimate
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+
+
+class KeysetChangeList(ChangeList):
+    """Changelist paged by primary key (``pk < cursor``) instead of OFFSET.
+
+    OFFSET makes the database read and discard every row before the page, so
+    deep pages get slower the larger the table is. Rows are always listed
+    newest first; the page links are "first" and "next".
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        try:
+            self.cursor = int(request.GET[CURSOR_VAR])
+        except (KeyError, ValueError):
+            self.cursor = None
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        queryset = self.queryset.order_by('-pk')
+        if self.cursor is not None:
+            queryset = queryset.filter(pk__lt=self.cursor)
+        results = list(queryset[:self.list_per_page + 1])
+
+        self.next_cursor = results[self.list_per_page - 1].pk if len(results) > self.list_per_page else None
+        self.result_list = results[:self.list_per_page]
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = bool(self.result_list)
+        self.can_show_all = False
+        self.multi_page = True
+        self.paginator = paginator
+
+    @property
+    def first_page_url(self):
+        return self.get_query_string(remove=[CURSOR_VAR])
+
+    @property
+    def next_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.next_cursor})
+
+
+class AutocompleteFilter(admin.SimpleListFilter):
+    """Sidebar filter on a foreign key that searches through the admin autocomplete view.
+
+    The default RelatedFieldListFilter renders every related row as a link.
+    """
+
+    template = 'admin/chat/autocomplete_filter.html'
+    field_name = None
+
+    def __init__(self, request, params, model, model_admin):
+        self.parameter_name = f'{self.field_name}__id__exact'
+        super().__init__(request, params, model, model_admin)
+        if self.value() and not self.value().isdigit():
+            # Same response as the stock filters: the changelist redirects with ?e=1
+            raise IncorrectLookupParameters(f'{self.parameter_name} must be an id')
+        field = model._meta.get_field(self.field_name)
+        form_field = forms.ModelChoiceField(
+            queryset=field.remote_field.model._default_manager.all(),
+            widget=AutocompleteSelect(field, model_admin.admin_site),
+            required=False,
+        )
+        self.rendered_widget = form_field.widget.render(
+            self.parameter_name, self.value(), attrs={'id': f'filter_{self.parameter_name}'},
+        )
+
+    def has_output(self):
+        return True
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{f'{self.field_name}_id': self.value()})
+        return queryset
+
+
+def autocomplete_filter(field_name, title):
+    return type(f'{field_name.title()}AutocompleteFilter', (AutocompleteFilter,), {
+        'field_name': field_name,
+        'title': title,
+    })
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """ModelAdmin for tables too large for exact counts, OFFSET paging or full select lists."""
+
+    change_list_template = 'admin/chat/keyset_change_list.html'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-pk',)
+    sortable_by = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    @property
+    def media(self):
+        media = super().media
+        for list_filter in self.list_filter:
+            if isinstance(list_filter, type) and issubclass(list_filter, AutocompleteFilter):
+                field = self.model._meta.get_field(list_filter.field_name)
+                media += AutocompleteSelect(field, self.admin_site).media
+                media += forms.Media(js=[
+                    'admin/js/vendor/jquery/jquery.js', 'admin/js/jquery.init.js', 'chat/autocomplete_filter.js',
+                ])
+        return media
+
 
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
@@ -10,14 +163,40 @@ class ProfileAdmin(admin.ModelAdmin):
 
 
 @admin.register(Chat)
-class ChatAdmin(admin.ModelAdmin):
+class ChatAdmin(LargeTableAdmin):
     list_display = ('id', 'name', 'is_group', 'created_at')
     search_fields = ('name',)
-    filter_horizontal = ('participants',)
+    search_help_text = 'Chat id, or part of the name.'
+    list_filter = ('is_group',)
+    autocomplete_fields = ('participants',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Also backs the chat autocomplete filter. Names are matched through the
+        # chat_chat_name_trgm index; direct chats have no name, so ids match too
+        # (``=id`` would compare id::text and skip the primary key index).
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        condition = Q(name__icontains=term)
+        if term.isdigit():
+            condition |= Q(pk=int(term))
+        return queryset.filter(condition), False
 
 
 @admin.register(Message)
-class MessageAdmin(admin.ModelAdmin):
+class MessageAdmin(LargeTableAdmin):
     list_display = ('chat', 'sender', 'timestamp')
-    search_fields = ('content', 'sender__username')
-    list_filter = ('chat',)
+    list_select_related = ('chat', 'sender')
+    search_fields = ('content',)
+    search_help_text = 'Full-text search of message content.'
+    list_filter = (autocomplete_filter('chat', 'chat'), autocomplete_filter('sender', 'sender'))
+    autocomplete_fields = ('chat', 'sender')
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or connections[queryset.db].vendor != 'postgresql':
+            return super().get_search_results(request, queryset, search_term)
+        # Same expression as the GIN index on Message, so the index is used
+        queryset = queryset.annotate(
+            search=SearchVector('content', config='simple'),
+        ).filter(search=SearchQuery(search_term, config='simple', search_type='websearch'))
+        return queryset, False
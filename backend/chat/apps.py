@@ -6,4 +6,11 @@ class ChatConfig(AppConfig):
     name = 'chat'
 
     def ready(self):
-        from . import signals  # Import signals so they register when app loads
\ No newline at end of file
+        from . import signals  # Import signals so they register when app loads
+        from django.contrib.auth.signals import user_logged_in
+
+        from .activity import record_login
+
+        # Buffer last_login writes instead of saving the user on every login
+        user_logged_in.disconnect(dispatch_uid='update_last_login')
+        user_logged_in.connect(record_login, dispatch_uid='chat.record_login')
\ No newline at end of file
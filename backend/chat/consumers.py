@@ -4,17 +4,24 @@ from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.utils import timezone
 
-from .models import Chat, Message
+from .activity import last_seen
+from .db_router import ConsumerRouting
+from .models import Attachment, Chat, Message
 
 User = get_user_model()
 
+MAX_ATTACHMENTS = 10
 
-class ChatConsumer(AsyncWebsocketConsumer):
+
+class ChatConsumer(ConsumerRouting, AsyncWebsocketConsumer):
     async def connect(self):
         self.chat_id = self.scope['url_route']['kwargs']['chat_id']
         self.room_group_name = f'chat_{self.chat_id}'
         user = self.scope['user']
+        self.pin_from_scope()
 
         if not user.is_authenticated:
             await self.close()
@@ -35,6 +42,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if self.scope['user'].is_authenticated:
+            await self.touch_last_seen()
 
     async def receive(self, text_data=None, bytes_data=None):
         if text_data is None:
@@ -45,19 +54,34 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.send(json.dumps({'error': 'Invalid JSON payload'}))
             return
 
-        message_text = payload.get('message')
-        if not message_text:
+        message_text = payload.get('message') or ''
+        attachment_ids = payload.get('attachments') or []
+        if not isinstance(attachment_ids, list) or not all(isinstance(i, int) for i in attachment_ids):
+            await self.send(json.dumps({'error': 'Attachments must be a list of ids'}))
+            return
+        if not isinstance(message_text, str):
+            await self.send(json.dumps({'error': 'Message must be text'}))
+            return
+        if len(attachment_ids) > MAX_ATTACHMENTS:
+            await self.send(json.dumps({'error': f'At most {MAX_ATTACHMENTS} attachments per message'}))
+            return
+        if not message_text and not attachment_ids:
             await self.send(json.dumps({'error': 'Message content required'}))
             return
 
         user = self.scope['user']
-        message = await self.save_message(user.id, message_text)
+        message = await self.save_message(user.id, message_text, attachment_ids)
+        if message is None:
+            await self.send(json.dumps({'error': 'Unknown or incomplete attachment'}))
+            return
+        # Only attachment references travel through the channel layer, never file contents
         event = {
             'type': 'chat_message',
             'message_id': message['id'],
             'username': message['username'],
             'message': message['content'],
             'timestamp': message['timestamp'],
+            'attachments': message['attachments'],
         }
         await self.channel_layer.group_send(self.room_group_name, event)
 
@@ -67,30 +91,54 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'username': event['username'],
             'message': event['message'],
             'timestamp': event['timestamp'],
+            'attachments': event.get('attachments', []),
         }))
+        # A connected reader has seen the message, so digests must not count them as offline
+        await self.touch_last_seen()
+
+    async def touch_last_seen(self):
+        user_id = self.scope['user'].id
+        if last_seen.interval:
+            last_seen.touch(user_id)  # only buffers; the flush thread writes it
+        else:
+            await database_sync_to_async(last_seen.touch)(user_id)
 
     @database_sync_to_async
     def get_chat(self):
-        try:
-            return Chat.objects.get(id=self.chat_id)
-        except Chat.DoesNotExist:
-            return None
+        with self.db_routing():
+            try:
+                return Chat.objects.get(id=self.chat_id)
+            except Chat.DoesNotExist:
+                return None
 
     @database_sync_to_async
     def user_in_chat(self, user_id: int) -> bool:
-        return Chat.objects.filter(id=self.chat_id, participants__id=user_id).exists()
+        last_seen.touch(user_id)
+        with self.db_routing():
+            return Chat.objects.filter(id=self.chat_id, participants__id=user_id).exists()
 
     @database_sync_to_async
-    def save_message(self, user_id: int, content: str):
-        try:
-            chat = Chat.objects.get(id=self.chat_id)
-            user = User.objects.get(id=user_id)
-        except ObjectDoesNotExist:
-            raise
-        message = Message.objects.create(chat=chat, sender=user, content=content)
+    def save_message(self, user_id: int, content: str, attachment_ids=()):
+        with self.db_routing(), transaction.atomic():
+            try:
+                chat = Chat.objects.get(id=self.chat_id)
+                user = User.objects.get(id=user_id)
+            except ObjectDoesNotExist:
+                raise
+            attachments = list(
+                Attachment.objects.select_for_update().filter(
+                    id__in=attachment_ids, chat=chat, uploader=user, linked_at__isnull=True, completed_at__isnull=False,
+                )
+            )
+            if len(attachments) != len(set(attachment_ids)):
+                return None
+            message = Message.objects.create(chat=chat, sender=user, content=content)
+            Attachment.objects.filter(id__in=[a.id for a in attachments]).update(message=message, linked_at=timezone.now())
+        last_seen.touch(user_id)
         return {
             'id': message.id,
             'username': user.username,
             'content': message.content,
             'timestamp': message.timestamp.isoformat(),
+            'attachments': [attachment.as_reference() for attachment in attachments],
         }
\ No newline at end of file
@@ -0,0 +1,125 @@
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+PIN_COOKIE = 'db_pin'
+
+
+def _pin_key(user_id) -> str:
+    return f'db_pin:{user_id}'
+
+
+def pin_user(user):
+    """Send ``user``'s reads to the primary for ``REPLICA_PIN_SECONDS``, on every device."""
+    if user is not None and user.is_authenticated:
+        cache.set(_pin_key(user.pk), 1, settings.REPLICA_PIN_SECONDS)
+
+
+def user_is_pinned(user) -> bool:
+    return user is not None and user.is_authenticated and cache.get(_pin_key(user.pk)) is not None
+
+
+class RoutingState:
+    """Per-request (or per consumer call) routing decision and write marker."""
+
+    def __init__(self, force_primary: bool = False):
+        self.force_primary = force_primary
+        self.wrote = False
+        self.replica = None
+
+
+_state = contextvars.ContextVar('db_routing_state', default=None)
+
+
+@contextmanager
+def routing(force_primary: bool = False):
+    """Let reads inside the block go to a replica unless ``force_primary`` is set.
+
+    Code running outside such a block (management commands, background
+    flushes) always reads from the primary, so it never sees replica lag.
+    """
+    state = RoutingState(force_primary)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """Send writes to ``default`` and reads to one of ``DATABASE_REPLICAS``."""
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if state is None or state.force_primary or state.wrote or not replicas:
+            return 'default'
+        # One replica per request, so reads never mix different replication lag
+        if state.replica not in replicas:
+            state.replica = random.choice(replicas)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+class ReadYourWritesMiddleware:
+    """Route reads to replicas, pinning a user to the primary after they write.
+
+    The pin is kept in the cache per user, so it covers every tab, device and
+    WebSocket of that user; anonymous clients get a short-lived cookie
+    instead. Must come after AuthenticationMiddleware, and after middleware
+    whose writes should not pin the user (sessions, last-seen tracking).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = PIN_COOKIE in request.COOKIES or user_is_pinned(getattr(request, 'user', None))
+        with routing(force_primary=pinned) as state:
+            response = self.get_response(request)
+        if state.wrote:
+            pin_user(getattr(request, 'user', None))  # may have logged in meanwhile
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
+
+
+class ConsumerRouting:
+    """Consumer mixin applying the same per-user primary pinning to WebSocket DB calls.
+
+    A write made through ``db_routing()`` pins the user, so their HTTP reads
+    (and other sockets) see it too; a handshake cookie pins this socket.
+    """
+
+    primary_until = 0.0
+
+    def pin_from_scope(self):
+        if PIN_COOKIE in self.scope.get('cookies', {}):
+            self.primary_until = time.monotonic() + settings.REPLICA_PIN_SECONDS
+
+    @contextmanager
+    def db_routing(self):
+        user = self.scope.get('user')
+        pinned = time.monotonic() < self.primary_until or user_is_pinned(user)
+        with routing(force_primary=pinned) as state:
+            try:
+                yield state
+            finally:
+                if state.wrote:
+                    pin_user(user)
@@ -0,0 +1,106 @@
+import mimetypes
+import os
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+BLOCK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def file_etag(path, stat=None) -> str:
+    """Cheap validator in nginx's style: mtime and size, no hashing of the content."""
+    stat = stat or os.stat(path)
+    return f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """Return ``(start, end)`` (inclusive) for a single byte range, ``None`` to
+    serve the whole file, or ``False`` if the range cannot be satisfied."""
+    match = _RANGE_RE.match((header or '').strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+async def _read_range(path, start, length):
+    """Yield ``length`` bytes from ``start`` in ``BLOCK_SIZE`` blocks.
+
+    An async generator: Django's ASGI handler would collect a sync iterator
+    into a list, i.e. load the whole file, before sending the first byte.
+    File I/O runs in the default executor rather than the shared sync thread
+    so slow disks do not hold up sync views.
+    """
+    read = sync_to_async(lambda fh, size: fh.read(size), thread_sensitive=False)
+    fh = await sync_to_async(open, thread_sensitive=False)(path, 'rb')
+    try:
+        fh.seek(start)
+        while length > 0:
+            block = await read(fh, min(BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        fh.close()
+
+
+def ranged_file_response(request, path, content_type=None, filename=None, as_attachment=False, sendfile_path=None):
+    """Serve a file from disk with ETag, conditional GET and single-range support.
+
+    If ``ATTACHMENT_SENDFILE_HEADER`` is set (``X-Accel-Redirect`` for nginx,
+    ``X-Sendfile`` for Apache/lighttpd) and ``sendfile_path`` is given, the body
+    is left to the front-end server, which handles ranges and zero-copy
+    sendfile itself; use that in production. Otherwise the body is streamed
+    from an async generator one ``BLOCK_SIZE`` block at a time, so memory use
+    stays flat under Daphne but every byte passes through Python.
+    """
+    stat = os.stat(path)
+    etag = file_etag(path, stat)
+    if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        return HttpResponseNotModified(headers={'ETag': etag})
+
+    content_type = content_type or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    headers = {'ETag': etag, 'Accept-Ranges': 'bytes'}
+    if filename:
+        headers['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+
+    sendfile_header = getattr(settings, 'ATTACHMENT_SENDFILE_HEADER', '')
+    if sendfile_header and sendfile_path:
+        headers[sendfile_header] = sendfile_path
+        return HttpResponse(content_type=content_type, headers=headers)
+
+    size = stat.st_size
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if 'Range' in request.headers and (if_range is None or if_range == etag):
+        byte_range = parse_range(request.headers['Range'], size)
+    if byte_range is False:
+        return HttpResponse(status=416, headers={'Content-Range': f'bytes */{size}', **headers})
+
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1
+    response = StreamingHttpResponse(
+        _read_range(path, start, length), status=206 if byte_range else 200,
+        content_type=content_type, headers=headers,
+    )
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = length
+    return response
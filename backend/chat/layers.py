@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+
+from channels.layers import InMemoryChannelLayer
+
+logger = logging.getLogger(__name__)
+
+
+class UnixSocketChannelLayer(InMemoryChannelLayer):
+    """In-memory channel layer whose ``group_send`` also reaches sibling processes.
+
+    Every process binds a datagram socket named ``<pid>.sock`` (or ``<name>.sock``) in
+    ``socket_dir``. A group message is delivered to local members as usual
+    and sent once to every other socket in the directory; the receiving
+    process then delivers it to its own members. Group membership and direct
+    ``send`` stay process-local, which is all ``ChatConsumer`` needs.
+    Messages must be JSON-serializable. One larger than ``max_datagram_size``
+    is written to a ``.msg`` file in ``socket_dir`` and only its name is sent;
+    files older than ``spool_seconds`` are removed by the next one spooled.
+    Forwarding never waits: a sibling whose receive queue is full misses the
+    message and a warning is logged.
+    """
+
+    max_datagram_size = 128 * 1024
+    spool_seconds = 60
+
+    def __init__(self, socket_dir, name=None, **kwargs):
+        super().__init__(**kwargs)
+        self.socket_dir = socket_dir
+        self.name = name
+        self._sock = None
+        self._pid = None
+
+    @property
+    def socket_path(self):
+        return os.path.join(self.socket_dir, f'{self.name or os.getpid()}.sock')
+
+    def _ensure_socket(self):
+        """Bind this process's socket and start reading from it (once per process)."""
+        if self._pid == os.getpid():
+            return
+        os.makedirs(self.socket_dir, exist_ok=True)
+        path = self.socket_path
+        if os.path.exists(path):
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        # The default send buffer caps datagram size (2 KiB on macOS)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 2 * self.max_datagram_size)
+        sock.bind(path)
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._on_datagram)
+        self._sock = sock
+        self._pid = os.getpid()
+
+    def _on_datagram(self):
+        while True:
+            try:
+                data = self._sock.recv(65536 * 4)
+            except BlockingIOError:
+                return
+            try:
+                if data.startswith(b'"'):
+                    data = self._read_spooled(json.loads(data))
+                group, message = json.loads(data)
+            except FileNotFoundError:
+                logger.warning('Dropping group message on %s: its file was already removed', self.socket_path)
+                continue
+            except ValueError:
+                logger.warning('Dropping malformed group message on %s', self.socket_path)
+                continue
+            asyncio.ensure_future(super().group_send(group, message))
+
+    def _read_spooled(self, name):
+        if os.path.basename(name) != name or not name.endswith('.msg'):
+            raise ValueError(name)
+        with open(os.path.join(self.socket_dir, name), 'rb') as fh:
+            return fh.read()
+
+    def _spool(self, payload):
+        """Write a payload too large for one datagram to a file; return the datagram naming it."""
+        # Also sweeps files left by workers that have exited
+        cutoff = time.time() - self.spool_seconds
+        for name in os.listdir(self.socket_dir):
+            if name.endswith('.msg'):
+                path = os.path.join(self.socket_dir, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.unlink(path)
+                except FileNotFoundError:
+                    pass
+        name = f'{uuid.uuid4().hex}.msg'
+        with open(os.path.join(self.socket_dir, name), 'wb') as fh:
+            fh.write(payload)
+        return json.dumps(name).encode()
+
+    async def group_add(self, group, channel):
+        self._ensure_socket()
+        await super().group_add(group, channel)
+
+    async def group_send(self, group, message):
+        self._ensure_socket()
+        await super().group_send(group, message)
+        own = os.path.basename(self.socket_path)
+        siblings = [name for name in os.listdir(self.socket_dir) if name != own and name.endswith('.sock')]
+        if not siblings:
+            return
+        payload = json.dumps([group, message]).encode()
+        if len(payload) > self.max_datagram_size:
+            payload = self._spool(payload)
+        for name in siblings:
+            path = os.path.join(self.socket_dir, name)
+            try:
+                self._sock.sendto(payload, path)
+            except BlockingIOError:
+                logger.warning('Dropping group message for %s: its receive queue is full', path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The worker that owned this socket is gone
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except OSError as exc:
+                logger.warning('Could not forward group message to %s: %s', path, exc)
+
+    async def flush(self):
+        await super().flush()
+        if self._sock is not None and self._pid == os.getpid():
+            asyncio.get_running_loop().remove_reader(self._sock.fileno())
+            self._sock.close()
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+        self._sock = None
+        self._pid = None
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from chat.models import Attachment
+
+
+class Command(BaseCommand):
+    help = """Delete attachments that can no longer be sent, along with their files.
+
+    That is uploads never sent with a message within --older-than seconds
+    (complete or not), and attachments whose message has been deleted.
+    Run it periodically, e.g. from cron.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=86400, help='Seconds an unsent upload is kept')
+        parser.add_argument('--batch-size', type=int, default=500, help='Attachments deleted per query')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options['older_than'])
+        stale = Attachment.objects.filter(
+            Q(linked_at__isnull=True, created_at__lt=cutoff) | Q(linked_at__isnull=False, message__isnull=True)
+        )
+        deleted = 0
+        while True:
+            # Deleting through the queryset sends post_delete, which removes each file
+            ids = list(stale.values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            deleted += Attachment.objects.filter(id__in=ids).delete()[0]
+        self.stdout.write(f'attachments deleted={deleted}')
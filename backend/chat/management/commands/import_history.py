@@ -0,0 +1,333 @@
+import csv
+import datetime
+import io
+import itertools
+import json
+import os
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from chat.models import Chat, HistoryImport, ImportedChat, Message
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = """Bulk-load chat history from an NDJSON or CSV dump.
+
+    Each record is one message with the fields:
+      chat         key of the chat in the source system
+      sender       username of the author (the user must already exist)
+      content      message text
+      timestamp    ISO 8601 timestamp
+      chat_name    optional, used when the chat is created
+      is_group     optional, "true"/"false" (default false)
+      participants optional usernames to add to the chat; a list in NDJSON,
+                   "|"-separated in CSV
+
+    Chat keys are shared by every file imported with the same --source, so a
+    dump split across files maps each chat once. A non-group chat becomes the
+    direct chat of its two users (reusing an existing one) only if its first
+    record names exactly two members through sender and participants;
+    otherwise it is imported as a group chat, as ChatCreateSerializer does.
+    A later record adding anyone else to a direct chat stops the import.
+
+    Messages are written with PostgreSQL COPY. Every batch commits together
+    with its checkpoint, so re-running the same command after an interruption
+    resumes at the first record that was not imported.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to the .ndjson or .csv dump')
+        parser.add_argument('--format', choices=['ndjson', 'csv'], help='Dump format (default: from file extension)')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Records per transaction')
+        parser.add_argument(
+            '--source', default='default',
+            help='Name of the system the dump comes from; files imported under the same name share chat keys',
+        )
+        parser.add_argument(
+            '--defer-indexes', action='store_true',
+            help='Drop secondary indexes on the message table during the import and rebuild them at the end. '
+                 'Chat lookups and search go unindexed meanwhile, so only use it while the app is offline.',
+        )
+        parser.add_argument('--restart', action='store_true', help='Forget the checkpoint and import from the start')
+        parser.add_argument(
+            '--noinput', '--no-input', action='store_false', dest='interactive',
+            help='Do not prompt before restarting an import that already loaded records',
+        )
+
+    def handle(self, *args, **options):
+        path = os.path.abspath(options['path'])
+        if not os.path.exists(path):
+            raise CommandError(f'File not found: {path}')
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        state, _ = HistoryImport.objects.get_or_create(source=path)
+        if options['restart']:
+            if state.records and options['interactive']:
+                confirm = input(
+                    f'{state.records} records from {path} are already imported and will not be removed; '
+                    'importing again duplicates them.\nType "yes" to restart anyway: '
+                )
+                if confirm != 'yes':
+                    raise CommandError('Restart cancelled.')
+            state.records = 0
+            state.position = 0
+            state.completed_at = None
+            state.save()
+        if state.completed_at:
+            self.stdout.write(f'{path} was already imported ({state.records} records); use --restart to import again.')
+            return
+        if state.records:
+            self.stdout.write(f'Resuming {path} after {state.records} records.')
+
+        if options['defer_indexes'] and not state.deferred_indexes:
+            self._drop_indexes(state)
+
+        self._source = options['source']
+        self._chat_ids = {}
+        self._pairs = {}  # chat id -> (low, high) user ids of direct chats
+        self._user_ids = {}
+        started = time.monotonic()
+        imported = 0
+        if fmt == 'ndjson':
+            fh = open(path, 'rb')
+            reader = self._read_ndjson(fh, state)
+        else:
+            fh = open(path, newline='', encoding='utf-8')
+            reader = self._read_csv(fh, state)
+        with fh:
+            while True:
+                batch = list(itertools.islice(reader, batch_size))
+                if not batch:
+                    break
+                self._import_batch(state, batch)
+                imported += len(batch)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'{state.records} records imported ({imported / elapsed if elapsed else 0:.0f}/s)'
+                )
+
+        if state.deferred_indexes:
+            self._restore_indexes(state)
+        state.completed_at = timezone.now()
+        state.save(update_fields=['completed_at'])
+        self.stdout.write(self.style.SUCCESS(f'Imported {imported} records from {path}.'))
+
+    def _read_ndjson(self, fh, state):
+        """Yield ``(record, position)`` pairs, resuming at the saved byte offset."""
+        fh.seek(state.position)
+        while True:
+            line = fh.readline()
+            if not line:
+                return
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as exc:
+                    raise CommandError(f'Invalid JSON at byte {fh.tell() - len(line)}: {exc}')
+                yield record, fh.tell()
+
+    def _read_csv(self, fh, state):
+        """Yield ``(record, position)`` pairs, skipping rows imported by earlier runs."""
+        rows = itertools.islice(csv.DictReader(fh), state.records, None)
+        for row in rows:
+            row['participants'] = [name for name in (row.get('participants') or '').split('|') if name]
+            yield row, 0
+
+    def _import_batch(self, state, batch):
+        records = [record for record, _ in batch]
+        with transaction.atomic():
+            self._resolve_chats(state, records)
+            usernames = {record['sender'] for record in records}
+            for record in records:
+                usernames.update(record.get('participants') or [])
+            self._resolve_users(usernames)
+
+            memberships = set()
+            messages = []
+            for record in records:
+                chat_id = self._chat_ids[str(record['chat'])]
+                sender_id = self._user_ids[record['sender']]
+                memberships.add((chat_id, sender_id))
+                for username in record.get('participants') or []:
+                    memberships.add((chat_id, self._user_ids[username]))
+                messages.append((chat_id, sender_id, record['content'], self._parse_timestamp(record)))
+            # A direct chat never gains a third member
+            for chat_id, user_id in memberships:
+                if chat_id in self._pairs and user_id not in self._pairs[chat_id]:
+                    key = next(key for key, value in self._chat_ids.items() if value == chat_id)
+                    raise CommandError(
+                        f'Chat {key!r} was imported as a direct chat but user id {user_id} also writes to it; '
+                        'mark it with is_group=true in the dump.'
+                    )
+
+            Membership = Chat.participants.through
+            Membership.objects.bulk_create(
+                [Membership(chat_id=chat_id, user_id=user_id) for chat_id, user_id in memberships],
+                ignore_conflicts=True,
+            )
+            self._copy_messages(messages)
+
+            state.records += len(batch)
+            state.position = batch[-1][1]
+            state.save(update_fields=['records', 'position'])
+
+    def _resolve_chats(self, state, records):
+        """Create chats for keys seen for the first time and remember their ids."""
+        new = {}
+        for record in records:
+            key = str(record['chat'])
+            if key not in self._chat_ids and key not in new:
+                new[key] = record
+        # Keys mapped by earlier runs or other files of the same source
+        mapped = ImportedChat.objects.filter(source_system=self._source, source_key__in=list(new)).values_list(
+            'source_key', 'chat_id', 'chat__direct_user_low_id', 'chat__direct_user_high_id',
+        )
+        for key, chat_id, low, high in mapped:
+            self._chat_ids[key] = chat_id
+            if low is not None:
+                self._pairs[chat_id] = (low, high)
+        new = {key: record for key, record in new.items() if key not in self._chat_ids}
+        if not new:
+            return
+
+        # Direct chats with a known pair reuse an existing chat for that pair
+        pairs = {}
+        for key, record in new.items():
+            participants = set(record.get('participants') or []) | {record['sender']}
+            if not _as_bool(record.get('is_group')) and len(participants) == 2:
+                pairs[key] = participants
+        self._resolve_users(set().union(*pairs.values()) if pairs else set())
+        pairs = {key: tuple(sorted(self._user_ids[name] for name in names)) for key, names in pairs.items()}
+        existing = {}
+        if pairs:
+            lookup = Q()
+            for low, high in set(pairs.values()):
+                lookup |= Q(direct_user_low_id=low, direct_user_high_id=high)
+            for chat_id, low, high in Chat.objects.filter(lookup).values_list('id', 'direct_user_low_id', 'direct_user_high_id'):
+                existing[(low, high)] = chat_id
+
+        to_create = {}
+        aliases = {}
+        created_pairs = {}
+        for key, record in new.items():
+            pair = pairs.get(key)
+            if pair in existing:
+                self._chat_ids[key] = existing[pair]
+                self._pairs[existing[pair]] = pair
+            elif pair in created_pairs:
+                aliases[key] = created_pairs[pair]
+            else:
+                if pair:
+                    created_pairs[pair] = key
+                to_create[key] = Chat(
+                    name=record.get('chat_name') or '',
+                    is_group=pair is None,
+                    direct_user_low_id=pair[0] if pair else None,
+                    direct_user_high_id=pair[1] if pair else None,
+                )
+        Chat.objects.bulk_create(to_create.values())
+        # created_at is auto_now_add; backdate it to the chat's first message
+        for key, chat in to_create.items():
+            chat.created_at = self._parse_timestamp(new[key])
+            self._chat_ids[key] = chat.id
+            if chat.direct_user_low_id is not None:
+                self._pairs[chat.id] = (chat.direct_user_low_id, chat.direct_user_high_id)
+        Chat.objects.bulk_update(to_create.values(), ['created_at'])
+        for key, target in aliases.items():
+            self._chat_ids[key] = self._chat_ids[target]
+        ImportedChat.objects.bulk_create(
+            [
+                ImportedChat(source_system=self._source, source_key=key, chat_id=self._chat_ids[key], history_import=state)
+                for key in new
+            ]
+        )
+
+    def _resolve_users(self, usernames):
+        missing = {name for name in usernames if name not in self._user_ids}
+        if not missing:
+            return
+        self._user_ids.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+        unknown = missing - self._user_ids.keys()
+        if unknown:
+            raise CommandError(f'Unknown users: {", ".join(sorted(unknown))}')
+
+    def _parse_timestamp(self, record):
+        value = parse_datetime(record['timestamp'])
+        if value is None:
+            raise CommandError(f'Invalid timestamp: {record["timestamp"]!r}')
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value, datetime.timezone.utc)
+        return value
+
+    def _copy_messages(self, messages):
+        table = Message._meta.db_table
+        columns = ('chat_id', 'sender_id', 'content', 'timestamp')
+        if connection.vendor != 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'INSERT INTO {table} ({", ".join(columns)}) VALUES (%s, %s, %s, %s)',
+                    [(c, s, text, connection.ops.adapt_datetimefield_value(ts)) for c, s, text, ts in messages],
+                )
+            return
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for chat_id, sender_id, content, ts in messages:
+            writer.writerow((chat_id, sender_id, content, ts.isoformat()))
+        buffer.seek(0)
+        sql = f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)'
+        with connection.cursor() as cursor:
+            raw = cursor.cursor
+            if hasattr(raw, 'copy_expert'):  # psycopg2
+                raw.copy_expert(sql, buffer)
+            else:  # psycopg 3
+                with raw.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+
+    def _drop_indexes(self, state):
+        """Drop the message table's secondary indexes, remembering how to rebuild them."""
+        if connection.vendor != 'postgresql':
+            self.stdout.write('--defer-indexes is only supported on PostgreSQL; ignoring.')
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT i.indexname, i.indexdef FROM pg_indexes i
+                WHERE i.tablename = %s
+                  AND i.indexdef NOT LIKE 'CREATE UNIQUE INDEX%%'
+                  AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname)
+                """,
+                [Message._meta.db_table],
+            )
+            indexes = cursor.fetchall()
+            # Save the definitions first so an interrupted run can still restore them
+            state.deferred_indexes = [definition for _, definition in indexes]
+            state.save(update_fields=['deferred_indexes'])
+            for name, _ in indexes:
+                cursor.execute(f'DROP INDEX IF EXISTS {connection.ops.quote_name(name)}')
+        self.stdout.write(f'Dropped {len(indexes)} indexes on {Message._meta.db_table}.')
+
+    def _restore_indexes(self, state):
+        with connection.cursor() as cursor:
+            for definition in state.deferred_indexes:
+                self.stdout.write(f'Rebuilding: {definition}')
+                cursor.execute(definition.replace('CREATE INDEX ', 'CREATE INDEX IF NOT EXISTS ', 1))
+            cursor.execute(f'ANALYZE {Message._meta.db_table}')
+        state.deferred_indexes = []
+        state.save(update_fields=['deferred_indexes'])
+
+
+def _as_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
@@ -0,0 +1,189 @@
+import logging
+import time
+from collections import defaultdict, deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from chat.models import Chat, Message, Profile
+
+logger = logging.getLogger(__name__)
+
+EMAIL_BACKENDS = {
+    'console': 'django.core.mail.backends.console.EmailBackend',
+    'file': 'django.core.mail.backends.filebased.EmailBackend',
+    'locmem': 'django.core.mail.backends.locmem.EmailBackend',
+}
+
+
+class Command(BaseCommand):
+    help = """Email offline users a digest of the chat messages they have not seen.
+
+    A message is unread for a user if someone else sent it to one of their
+    chats after the user was last seen (Profile.last_seen) and after their
+    previous digest. Users count as offline once they have been inactive for
+    --offline-after seconds. Digests are rendered in batches and sent over
+    one reused mail connection.
+    """
+
+    latest_per_chat = 3
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=900, help='Seconds between digest runs')
+        parser.add_argument('--offline-after', type=int, default=300, help='Seconds of inactivity before a user is offline')
+        parser.add_argument('--max-age', type=int, default=86400, help='Ignore messages older than this many seconds')
+        parser.add_argument('--batch-size', type=int, default=200, help='Users rendered and sent per batch')
+        parser.add_argument('--once', action='store_true', help='Run a single pass and exit')
+        parser.add_argument(
+            '--email-backend',
+            help=f'Email backend path, or one of {", ".join(EMAIL_BACKENDS)} (default: EMAIL_BACKEND)',
+        )
+
+    def handle(self, *args, **options):
+        backend = options['email_backend']
+        self.backend = EMAIL_BACKENDS.get(backend, backend)
+        while True:
+            # A long-running loop has no request cycle to drop broken or expired connections
+            close_old_connections()
+            try:
+                self.run_once(options)
+            except Exception:
+                if options['once']:
+                    raise
+                logger.exception('Digest run failed; retrying in %d seconds', options['interval'])
+            if options['once']:
+                return
+            time.sleep(options['interval'])
+
+    def run_once(self, options):
+        started = time.monotonic()
+        now = timezone.now()
+        offline_cutoff = now - timedelta(seconds=options['offline_after'])
+        oldest = now - timedelta(seconds=options['max_age'])
+        profiles = (
+            Profile.objects.filter(Q(last_seen__lt=offline_cutoff) | Q(last_seen__isnull=True))
+            .exclude(user__email='')
+            .filter(user__is_active=True)
+            .select_related('user')
+            .order_by('pk')
+        )
+
+        sent = messages_total = batches = 0
+        self.failed = 0
+        connection = get_connection(backend=self.backend)
+        connection.open()
+        try:
+            batch = []
+            for profile in profiles.iterator(chunk_size=options['batch_size']):
+                batch.append(profile)
+                if len(batch) >= options['batch_size']:
+                    count, included = self.send_batch(connection, batch, oldest, now)
+                    sent += count
+                    messages_total += included
+                    batches += 1
+                    batch = []
+            if batch:
+                count, included = self.send_batch(connection, batch, oldest, now)
+                sent += count
+                messages_total += included
+                batches += 1
+        finally:
+            connection.close()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'digests={sent} failed={self.failed} messages={messages_total} batches={batches} '
+            f'elapsed={elapsed:.2f}s rate={sent / elapsed if elapsed else 0:.1f} digests/s'
+        )
+
+    def send_batch(self, connection, profiles, oldest, now):
+        """Render and send digests for one batch of profiles; return (digests, messages)."""
+        cutoffs = {
+            profile.user_id: max(filter(None, [profile.last_seen, profile.digest_sent_at, oldest]))
+            for profile in profiles
+        }
+        members = defaultdict(list)
+        Membership = Chat.participants.through
+        for chat_id, user_id in Membership.objects.filter(user_id__in=cutoffs).values_list('chat_id', 'user_id'):
+            members[chat_id].append(user_id)
+        if not members:
+            return 0, 0
+
+        # user id -> chat -> count and the latest few messages; only those get rendered
+        unread = defaultdict(dict)
+        rows = (
+            Message.objects.filter(chat_id__in=list(members), timestamp__gt=min(cutoffs.values()), timestamp__lte=now)
+            .order_by('timestamp')
+            .values_list('chat_id', 'chat__name', 'sender_id', 'sender__username', 'content', 'timestamp')
+            .iterator(chunk_size=2000)
+        )
+        for chat_id, chat_name, sender_id, sender, content, timestamp in rows:
+            message = None
+            for user_id in members[chat_id]:
+                if user_id == sender_id or timestamp <= cutoffs[user_id]:
+                    continue
+                chat = unread[user_id].get(chat_id)
+                if chat is None:
+                    chat = unread[user_id][chat_id] = {
+                        'name': chat_name, 'count': 0, 'senders': set(),
+                        'latest': deque(maxlen=self.latest_per_chat),
+                    }
+                if message is None:
+                    message = {'sender': sender, 'content': content, 'timestamp': timestamp}
+                chat['count'] += 1
+                chat['senders'].add(sender)
+                chat['latest'].append(message)
+
+        emails = {}
+        included = {}
+        for profile in profiles:
+            chats = unread.get(profile.user_id)
+            if not chats:
+                continue
+            context = {'user': profile.user, 'chats': [], 'total': 0}
+            for chat in chats.values():
+                context['chats'].append({
+                    'title': chat['name'] or f'Chat with {", ".join(sorted(chat["senders"]))}',
+                    'count': chat['count'],
+                    'latest': list(chat['latest']),
+                    'more': chat['count'] - len(chat['latest']),
+                })
+                context['total'] += chat['count']
+            subject = f"{context['total']} unread message{'s' if context['total'] != 1 else ''}"
+            emails[profile.pk] = EmailMessage(
+                subject,
+                render_to_string('email/digest.txt', context),
+                settings.DEFAULT_FROM_EMAIL,
+                [profile.user.email],
+                connection=connection,
+            )
+            included[profile.pk] = context['total']
+
+        # One message per send_messages() call on the shared connection, so a
+        # failure only loses that digest and everything delivered is recorded
+        delivered = []
+        for profile_pk, email in emails.items():
+            try:
+                if connection.send_messages([email]):
+                    delivered.append(profile_pk)
+            except Exception:
+                logger.exception('Could not send digest to %s', ', '.join(email.to))
+                self.failed += 1
+                self._reconnect(connection)
+        if delivered:
+            Profile.objects.filter(pk__in=delivered).update(digest_sent_at=now)
+        return len(delivered), sum(included[pk] for pk in delivered)
+
+    def _reconnect(self, connection):
+        """Replace a connection that may have been broken by a failed send."""
+        try:
+            connection.close()
+            connection.open()
+        except Exception:
+            logger.exception('Could not reopen the mail connection')
@@ -0,0 +1,138 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = """Run the ASGI application in several Daphne worker processes.
+
+    Each worker binds its own SO_REUSEPORT socket on the same address, so the
+    kernel spreads connections across them, and dead workers are restarted.
+    A worker that keeps dying within --stable-after seconds of starting is
+    restarted with exponential backoff (1s doubling up to max_backoff); after
+    --max-restarts such failures in a row all workers are stopped.
+    Unless CHANNEL_LAYERS already points at a cross-process backend (e.g.
+    Redis), workers use chat.layers.UnixSocketChannelLayer so group_send
+    reaches WebSocket clients in every worker.
+
+    Workers are started as fresh interpreters rather than bare forks: Daphne
+    installs its Twisted reactor (and its epoll descriptor) when Django loads,
+    and that must not be shared between processes.
+    """
+
+    max_backoff = 60
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--socket-dir', help='Directory for the cross-worker broadcast sockets')
+        parser.add_argument('--max-restarts', type=int, default=5, help='Fast failures in a row before giving up')
+        parser.add_argument('--stable-after', type=int, default=30, help='Seconds a worker must run to count as started')
+        parser.add_argument('--worker', action='store_true', help='Internal: run a single worker')
+
+    def handle(self, *args, **options):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise CommandError('serve_workers needs SO_REUSEPORT (Linux, BSD or macOS).')
+        if options['worker']:
+            self._run_worker(options['host'], options['port'])
+            return
+        if ':' in options['host']:
+            raise CommandError('serve_workers only supports IPv4 addresses.')
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1.')
+
+        env = dict(os.environ)
+        backend = settings.CHANNEL_LAYERS.get('default', {}).get('BACKEND')
+        if backend in ('channels.layers.InMemoryChannelLayer', 'chat.layers.UnixSocketChannelLayer'):
+            socket_dir = (
+                options['socket_dir']
+                or os.environ.get('CHANNEL_LAYER_SOCKET_DIR')
+                or tempfile.mkdtemp(prefix='chat-layer-')
+            )
+            env['CHANNEL_LAYER_SOCKET_DIR'] = socket_dir
+            self.stdout.write(f'Cross-worker group broadcast via {socket_dir}')
+
+        command = [
+            sys.executable, os.path.abspath(sys.argv[0]), 'serve_workers', '--worker',
+            '--host', options['host'], '--port', str(options['port']),
+        ]
+        workers = []
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+            for worker in workers:
+                if worker.poll() is None:
+                    worker.terminate()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        for _ in range(options['workers']):
+            workers.append(subprocess.Popen(command, env=env))
+        self.stdout.write(f"Serving on {options['host']}:{options['port']} with {len(workers)} workers")
+
+        started = [time.monotonic()] * len(workers)
+        failures = [0] * len(workers)
+        restart_at = [None] * len(workers)
+        gave_up = False
+        while not stopping:
+            time.sleep(1)
+            now = time.monotonic()
+            for index, worker in enumerate(workers):
+                if stopping:
+                    break
+                if restart_at[index] is not None:
+                    if now >= restart_at[index]:
+                        workers[index] = subprocess.Popen(command, env=env)
+                        started[index] = now
+                        restart_at[index] = None
+                    continue
+                if worker.poll() is None:
+                    continue
+                if now - started[index] >= options['stable_after']:
+                    failures[index] = 0
+                failures[index] += 1
+                if failures[index] > options['max_restarts']:
+                    self.stderr.write(
+                        f'Worker {worker.pid} exited with status {worker.returncode}; '
+                        f'{options["max_restarts"]} restarts failed, stopping all workers'
+                    )
+                    gave_up = True
+                    stop(None, None)
+                    break
+                delay = min(2 ** (failures[index] - 1), self.max_backoff)
+                self.stderr.write(f'Worker {worker.pid} exited with status {worker.returncode}; restarting in {delay}s')
+                restart_at[index] = now + delay
+        for worker in workers:
+            worker.wait()
+        if gave_up:
+            raise CommandError('Workers keep exiting right after they start; see the errors above.')
+
+    def _run_worker(self, host, port):
+        from daphne.server import Server
+
+        from chatserver.asgi import application
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        sock.listen(1024)
+        sock.setblocking(False)
+
+        # Twisted's fd: endpoint adopts the already-bound socket (IPv4 only)
+        Server(
+            application=application,
+            endpoints=[f'fd:fileno={sock.fileno()}'],
+            signal_handlers=True,
+        ).run()
@@ -0,0 +1,15 @@
+from .activity import last_seen
+
+
+class LastSeenMiddleware:
+    """Record the authenticated user's activity in the buffered last-seen tracker."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            last_seen.touch(user.pk)
+        return response
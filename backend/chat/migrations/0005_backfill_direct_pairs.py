@@ -0,0 +1,54 @@
+from django.db import migrations
+
+
+def backfill_direct_pairs(apps, schema_editor):
+    """Key every two-person direct chat by its participant pair.
+
+    When the same pair has several direct chats, the oldest one is kept and
+    the messages of the others are moved into it before they are deleted.
+    """
+    Chat = apps.get_model('chat', 'Chat')
+    Message = apps.get_model('chat', 'Message')
+    Membership = Chat.participants.through
+
+    members = {}
+    rows = (
+        Membership.objects.filter(chat__is_group=False)
+        .values_list('chat_id', 'user_id')
+        .order_by('chat_id')
+        .iterator(chunk_size=2000)
+    )
+    for chat_id, user_id in rows:
+        members.setdefault(chat_id, []).append(user_id)
+
+    keepers = {}
+    duplicates = {}
+    for chat_id, user_ids in sorted(members.items()):
+        if len(user_ids) != 2:
+            continue
+        pair = tuple(sorted(user_ids))
+        if pair in keepers:
+            duplicates[chat_id] = keepers[pair]
+        else:
+            keepers[pair] = chat_id
+
+    for duplicate_id, keeper_id in duplicates.items():
+        Message.objects.filter(chat_id=duplicate_id).update(chat_id=keeper_id)
+    Chat.objects.filter(id__in=list(duplicates)).delete()
+
+    to_update = [
+        Chat(id=chat_id, direct_user_low_id=low, direct_user_high_id=high)
+        for (low, high), chat_id in keepers.items()
+    ]
+    Chat.objects.bulk_update(to_update, ['direct_user_low', 'direct_user_high'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_chat_direct_pair'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_direct_pairs, migrations.RunPython.noop),
+    ]
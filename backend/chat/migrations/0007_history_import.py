@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_chat_unique_direct_pair'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=500, unique=True)),
+                ('records', models.BigIntegerField(default=0)),
+                ('position', models.BigIntegerField(default=0)),
+                ('deferred_indexes', models.JSONField(blank=True, default=list)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ImportedChat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_key', models.CharField(max_length=255)),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chat.chat')),
+                ('history_import', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chats', to='chat.historyimport')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('history_import', 'source_key'), name='imported_chat_unique_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def drop_duplicate_keys(apps, schema_editor):
+    """Keys used to be unique per file; keep the oldest mapping of each key."""
+    ImportedChat = apps.get_model('chat', 'ImportedChat')
+    seen = set()
+    duplicates = []
+    for pk, key in ImportedChat.objects.order_by('pk').values_list('pk', 'source_key').iterator():
+        if key in seen:
+            duplicates.append(pk)
+        seen.add(key)
+    ImportedChat.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_chat_name_trgm'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='importedchat',
+            name='imported_chat_unique_key',
+        ),
+        migrations.AddField(
+            model_name='importedchat',
+            name='source_system',
+            field=models.CharField(default='default', max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='importedchat',
+            name='history_import',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='chats', to='chat.historyimport'),
+        ),
+        migrations.RunPython(drop_duplicate_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='importedchat',
+            constraint=models.UniqueConstraint(fields=('source_system', 'source_key'), name='imported_chat_unique_source_key'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:25
+
+from django.db import migrations, models
+
+
+def backfill_linked_at(apps, schema_editor):
+    """Attachments already sent with a message count as linked since they completed."""
+    Attachment = apps.get_model('chat', 'Attachment')
+    Attachment.objects.filter(message__isnull=False).update(linked_at=models.F('completed_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_importedchat_source_system'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='linked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_linked_at, migrations.RunPython.noop),
+    ]
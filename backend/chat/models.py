@@ -1,5 +1,15 @@
+import os
+import uuid
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Cast, Upper
+from django.urls import reverse
+from django.utils import timezone
 
 User = get_user_model()
 
@@ -9,16 +19,92 @@ class Profile(models.Model):
     nickname = models.CharField(max_length=150, blank=True)
     avatar = models.ImageField(upload_to='avatars/', default='avatars/default.png', blank=True)
     status = models.CharField(max_length=255, blank=True)
+    last_seen = models.DateTimeField(null=True, blank=True)
+    digest_sent_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self) -> str:
         return f"Profile({self.user.username})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values) if value is not models.DEFERRED
+        }
+        return instance
+
+    def has_changes(self) -> bool:
+        """Return True if any loaded field differs from the value read from the database."""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return True
+        return any(
+            getattr(self, field.attname) != loaded[field.attname]
+            for field in self._meta.concrete_fields
+            if field.attname in loaded
+        )
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {
+            field.attname: field.get_prep_value(getattr(self, field.attname))
+            for field in self._meta.concrete_fields
+            if field.attname not in self.get_deferred_fields()
+        }
+
+
+class ChatQuerySet(models.QuerySet):
+    def get_or_create_direct(self, user, other):
+        """Return ``(chat, created)`` for the direct chat between two users.
+
+        Direct chats carry their participant pair ordered as (low id, high id)
+        under a unique constraint, so the lookup is a single indexed query and
+        two concurrent requests cannot both create the chat.
+        """
+        low, high = sorted((user.pk, other.pk))
+        lookup = {'is_group': False, 'direct_user_low_id': low, 'direct_user_high_id': high}
+        try:
+            return self.get(**lookup), False
+        except self.model.DoesNotExist:
+            pass
+        try:
+            with transaction.atomic():
+                chat = self.create(**lookup)
+                chat.participants.add(low, high)
+            return chat, True
+        except IntegrityError:
+            return self.get(**lookup), False
+
 
 class Chat(models.Model):
     name = models.CharField(max_length=100, blank=True)
     participants = models.ManyToManyField(User, related_name='chats')
     is_group = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Canonical participant pair of a direct chat; null for group chats
+    direct_user_low = models.ForeignKey(
+        User, related_name='+', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+    )
+    direct_user_high = models.ForeignKey(
+        User, related_name='+', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+    )
+
+    objects = ChatQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['direct_user_low', 'direct_user_high'],
+                name='chat_unique_direct_pair',
+            ),
+        ]
+        indexes = [
+            # Trigram index matching the admin's name__icontains search (UPPER(name::text) LIKE ...)
+            GinIndex(
+                OpClass(Upper(Cast('name', output_field=models.TextField())), name='gin_trgm_ops'),
+                name='chat_chat_name_trgm',
+            ),
+        ]
 
     def __str__(self) -> str:
         base = self.name or 'Direct Chat'
@@ -33,7 +119,103 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Full-text index used by the admin message search
+            GinIndex(SearchVector('content', config='simple'), name='chat_message_content_fts'),
+        ]
 
     def __str__(self) -> str:
         preview = (self.content[:15] + '...') if len(self.content) > 18 else self.content
         return f"Message({self.sender.username}: {preview})"
+
+
+class AttachmentStorage(FileSystemStorage):
+    """FileSystemStorage rooted at ``ATTACHMENT_ROOT``, read on every access.
+
+    The field's storage is built once when the model loads; reading the
+    setting lazily keeps ``override_settings(ATTACHMENT_ROOT=...)`` working.
+    """
+
+    @property
+    def base_location(self):
+        return settings.ATTACHMENT_ROOT
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+
+def attachment_storage():
+    # Kept outside MEDIA_ROOT so files are only reachable through the access-checked download view
+    return AttachmentStorage()
+
+
+def attachment_path(instance, filename):
+    return f'{timezone.now():%Y/%m}/{uuid.uuid4().hex}'
+
+
+class Attachment(models.Model):
+    """A file uploaded in chunks to a chat and later linked to a message."""
+
+    chat = models.ForeignKey(Chat, related_name='attachments', on_delete=models.CASCADE)
+    uploader = models.ForeignKey(User, related_name='attachments', on_delete=models.CASCADE)
+    message = models.ForeignKey(
+        Message, related_name='attachments', on_delete=models.SET_NULL, null=True, blank=True,
+    )
+    file = models.FileField(storage=attachment_storage, upload_to=attachment_path, max_length=255)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    # Set once when sent with a message; message alone goes back to NULL if that message is deleted
+    linked_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"Attachment({self.filename}, {self.received}/{self.size})"
+
+    def as_reference(self) -> dict:
+        """Small description sent to clients in place of the file contents."""
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'content_type': self.content_type,
+            'size': self.size,
+            'url': reverse('attachment-download', args=[self.id]),
+        }
+
+
+class HistoryImport(models.Model):
+    """Progress of an ``import_history`` run, committed together with each batch."""
+
+    source = models.CharField(max_length=500, unique=True)
+    records = models.BigIntegerField(default=0)
+    position = models.BigIntegerField(default=0)
+    deferred_indexes = models.JSONField(default=list, blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"HistoryImport({self.source}: {self.records})"
+
+
+class ImportedChat(models.Model):
+    """Maps a chat key from a source system to the chat created for it.
+
+    Keys are shared by every dump imported under the same ``source_system``,
+    so a chat split across several files is created once.
+    """
+
+    source_system = models.CharField(max_length=100, default='default')
+    source_key = models.CharField(max_length=255)
+    chat = models.ForeignKey(Chat, related_name='+', on_delete=models.CASCADE)
+    # The import that first saw the key
+    history_import = models.ForeignKey(
+        HistoryImport, related_name='chats', on_delete=models.SET_NULL, null=True, blank=True,
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source_system', 'source_key'], name='imported_chat_unique_source_key'),
+        ]
@@ -1,7 +1,12 @@
+import os
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.utils import timezone
 from rest_framework import serializers
 
-from .models import Chat, Message, Profile
+from .models import Attachment, Chat, Message, Profile
 
 User = get_user_model()
 
@@ -11,8 +16,8 @@ class ProfileSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Profile
-        fields = ['id', 'username', 'nickname', 'avatar', 'status']
-        read_only_fields = ['id', 'username']
+        fields = ['id', 'username', 'nickname', 'avatar', 'status', 'last_seen']
+        read_only_fields = ['id', 'username', 'last_seen']
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -25,12 +30,64 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class MessageSerializer(serializers.ModelSerializer):
+    sender = serializers.CharField(source='sender.username', read_only=True)
+    attachments = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Message
+        fields = ['id', 'chat', 'sender', 'content', 'timestamp', 'attachments']
+        read_only_fields = ['id', 'sender', 'timestamp', 'attachments']
+
+    def get_attachments(self, obj):
+        return [attachment.as_reference() for attachment in obj.attachments.all()]
+
+
+class LastMessageSerializer(serializers.ModelSerializer):
+    """Chat list preview of a message; attachments are left out to keep the list to one query per chat."""
+
     sender = serializers.CharField(source='sender.username', read_only=True)
 
     class Meta:
         model = Message
         fields = ['id', 'chat', 'sender', 'content', 'timestamp']
-        read_only_fields = ['id', 'sender', 'timestamp']
+        read_only_fields = fields
+
+
+class AttachmentSerializer(serializers.ModelSerializer):
+    completed = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Attachment
+        fields = ['id', 'chat', 'filename', 'content_type', 'size', 'received', 'completed', 'created_at']
+        read_only_fields = ['id', 'received', 'completed', 'created_at']
+
+    def get_completed(self, obj):
+        return obj.completed_at is not None
+
+    def validate_chat(self, value):
+        if not value.participants.filter(id=self.context['request'].user.id).exists():
+            raise serializers.ValidationError('You must be part of the chat to upload attachments.')
+        return value
+
+    def validate_filename(self, value):
+        value = os.path.basename(value.replace('\\', '/')).strip()
+        if not value:
+            raise serializers.ValidationError('A file name is required.')
+        return value
+
+    def validate_size(self, value):
+        if value < 0 or value > settings.ATTACHMENT_MAX_SIZE:
+            raise serializers.ValidationError(f'Size must be between 0 and {settings.ATTACHMENT_MAX_SIZE} bytes.')
+        return value
+
+    def create(self, validated_data):
+        attachment = Attachment(uploader=self.context['request'].user, **validated_data)
+        # Allocate an empty file that upload chunks are written into
+        attachment.file.save(attachment.filename, ContentFile(b''), save=False)
+        if attachment.size == 0:
+            attachment.completed_at = timezone.now()
+        attachment.save()
+        return attachment
 
 
 class ChatSerializer(serializers.ModelSerializer):
@@ -43,9 +100,9 @@ class ChatSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'participants', 'last_message', 'created_at']
 
     def get_last_message(self, obj):
-        message = obj.messages.order_by('-timestamp').first()
+        message = obj.messages.select_related('sender').order_by('-timestamp').first()
         if message:
-            return MessageSerializer(message).data
+            return LastMessageSerializer(message).data
         return None
 
 
@@ -67,6 +124,14 @@ class ChatCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Provide at least one participant user ID.')
         return unique_ids
 
+    def validate(self, attrs):
+        if self.instance is not None:
+            if 'is_group' in attrs and attrs['is_group'] != self.instance.is_group:
+                raise serializers.ValidationError({'is_group': 'A chat cannot be switched between direct and group.'})
+            if not self.instance.is_group and 'participant_ids' in attrs:
+                raise serializers.ValidationError({'participant_ids': 'Participants of a direct chat cannot be changed.'})
+        return attrs
+
     def create(self, validated_data):
         participant_ids = validated_data.pop('participant_ids', [])
         request_user = self.context['request'].user
@@ -76,6 +141,15 @@ class ChatCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({'participant_ids': f'Unknown user ids: {sorted(missing_ids)}'})
         if request_user not in participants:
             participants.append(request_user)
+        if not validated_data.get('is_group'):
+            if len(participants) == 2:
+                # Same keyed lookup as ChatViewSet.start, so no duplicate DMs
+                chat, created = Chat.objects.get_or_create_direct(*participants)
+                if created and validated_data.get('name'):
+                    chat.name = validated_data['name']
+                    chat.save(update_fields=['name'])
+                return chat
+            validated_data['is_group'] = True
         chat = Chat.objects.create(**validated_data)
         chat.participants.add(*participants)
         return chat
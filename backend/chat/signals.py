@@ -1,8 +1,8 @@
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from .models import Profile
+from .models import Attachment, Profile
 
 User = get_user_model()
 
@@ -14,5 +14,16 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
\ No newline at end of file
+def save_user_profile(sender, instance, created, **kwargs):
+    # Only persist a profile that was loaded and edited through the user;
+    # otherwise every user save would read and rewrite the profile row.
+    if created or not User.profile.is_cached(instance):
+        return
+    if instance.profile.has_changes():
+        instance.profile.save()
+
+@receiver(post_delete, sender=Attachment)
+def delete_attachment_file(sender, instance, **kwargs):
+    # Also runs for attachments removed with their chat or uploader
+    if instance.file:
+        instance.file.delete(save=False)
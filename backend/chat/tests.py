@@ -1,6 +1,610 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import socket
+import tempfile
+import threading
+from datetime import timedelta
+from unittest.mock import AsyncMock, Mock, patch
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .activity import LastSeenTracker, last_seen
+from .admin import MessageAdmin
+from .consumers import ChatConsumer
+from .management.commands import send_digests, serve_workers
+from .management.commands.send_digests import Command as SendDigestsCommand
+from .db_router import PIN_COOKIE, ConsumerRouting, PrimaryReplicaRouter, routing, user_is_pinned
+from .layers import UnixSocketChannelLayer
+from .models import Attachment, Chat, HistoryImport, Message, Profile
+
+User = get_user_model()
+
+
+def read_stream(response):
+    """Collect the body of a streaming response, sync or async."""
+    if not response.is_async:
+        return b''.join(response.streaming_content)
+
+    async def collect():
+        return b''.join([part async for part in response.streaming_content])
+    return async_to_sync(collect)()
 
 
 class PlaceholderTest(TestCase):
     def test_placeholder(self):
-        self.assertTrue(True)
\ No newline at end of file
+        self.assertTrue(True)
+
+
+class LastSeenTrackerTest(TestCase):
+    def setUp(self):
+        last_seen.flush()  # drop timestamps buffered by earlier tests
+        self.user = User.objects.create_user(username='alice', password='pw-alice-123')
+
+    @override_settings(LAST_SEEN_FLUSH_INTERVAL=3600)
+    def test_login_is_buffered_until_flush(self):
+        self.client.force_login(self.user)
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.last_login)
+
+        with self.assertNumQueries(2):
+            last_seen.flush()
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+        self.assertEqual(Profile.objects.get(user=self.user).last_seen, self.user.last_login)
+
+    @override_settings(LAST_SEEN_FLUSH_INTERVAL=0.01)
+    def test_flush_thread_writes_without_further_activity(self):
+        tracker = LastSeenTracker()
+        flushed = threading.Event()
+        with patch.object(tracker, '_bulk_update', side_effect=lambda *args: flushed.set()):
+            with self.assertNumQueries(0):
+                tracker.touch(self.user.pk)
+            self.assertTrue(flushed.wait(5))
+
+    def test_user_save_skips_unchanged_profile(self):
+        user = User.objects.select_related('profile').get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            user.save(update_fields=['first_name'])
+        user.profile.status = 'busy'
+        with self.assertNumQueries(2):
+            user.save()
+        self.assertEqual(Profile.objects.get(user=user).status, 'busy')
+
+
+class DirectChatTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='pw-alice-123')
+        self.bob = User.objects.create_user(username='bob', password='pw-bob-123')
+
+    def test_start_reuses_existing_direct_chat(self):
+        self.client.force_login(self.alice)
+        first = self.client.post('/api/chats/start/', {'username': 'bob'}, content_type='application/json')
+        self.assertEqual(first.status_code, 201)
+
+        self.client.force_login(self.bob)
+        second = self.client.post('/api/chats/start/', {'username': 'alice'}, content_type='application/json')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(first.json()['id'], second.json()['id'])
+        self.assertEqual(Chat.objects.filter(is_group=False).count(), 1)
+
+    def test_get_or_create_direct_is_order_independent(self):
+        chat, created = Chat.objects.get_or_create_direct(self.bob, self.alice)
+        self.assertTrue(created)
+        self.assertEqual((chat.direct_user_low, chat.direct_user_high), (self.alice, self.bob))
+        self.assertEqual(Chat.objects.get_or_create_direct(self.alice, self.bob), (chat, False))
+
+    def test_create_without_group_reuses_direct_chat(self):
+        chat, _ = Chat.objects.get_or_create_direct(self.alice, self.bob)
+        self.client.force_login(self.alice)
+        response = self.client.post(
+            '/api/chats/', {'is_group': False, 'participant_ids': [self.bob.pk]}, content_type='application/json',
+        )
+        self.assertEqual(response.json()['id'], chat.pk)
+        self.assertEqual(Chat.objects.count(), 1)
+
+    def test_direct_chat_participants_cannot_change(self):
+        carol = User.objects.create_user(username='carol', password='pw-carol-123')
+        chat, _ = Chat.objects.get_or_create_direct(self.alice, self.bob)
+        self.client.force_login(self.alice)
+        url = f'/api/chats/{chat.pk}/'
+        response = self.client.patch(url, {'participant_ids': [carol.pk]}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch(url, {'is_group': True}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(chat.participants.values_list('id', flat=True)), {self.alice.pk, self.bob.pk})
+
+
+class ChatExportTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='pw-alice-123')
+        self.bob = User.objects.create_user(username='bob', password='pw-bob-123')
+        self.chat, _ = Chat.objects.get_or_create_direct(self.alice, self.bob)
+        Message.objects.create(chat=self.chat, sender=self.alice, content='hello')
+        Message.objects.create(chat=self.chat, sender=self.bob, content='hi, alice')
+        self.client.force_login(self.alice)
+
+    def test_export_ndjson(self):
+        response = self.client.get(f'/api/chats/{self.chat.id}/export/')
+        self.assertEqual(response.status_code, 200)
+        lines = read_stream(response).decode().splitlines()
+        self.assertEqual([json.loads(line)['content'] for line in lines], ['hello', 'hi, alice'])
+
+    def test_export_csv(self):
+        response = self.client.get(f'/api/chats/{self.chat.id}/export/', {'type': 'csv'})
+        rows = list(csv.reader(read_stream(response).decode().splitlines()))
+        self.assertEqual(rows[0], ['id', 'sender', 'content', 'timestamp'])
+        self.assertEqual([row[1:3] for row in rows[1:]], [['alice', 'hello'], ['bob', 'hi, alice']])
+
+    @patch('chat.views.EXPORT_CHUNK_SIZE', 1)
+    async def test_export_streams_asynchronously_under_asgi(self):
+        await self.async_client.aforce_login(self.alice)
+        response = await self.async_client.get(f'/api/chats/{self.chat.id}/export/')
+        self.assertTrue(response.is_async)
+        first_block = await anext(aiter(response.streaming_content))
+        self.assertEqual(json.loads(first_block)['content'], 'hello')
+
+    @patch('chat.views.EXPORT_CHUNK_SIZE', 1)
+    def test_export_streams_synchronously_under_wsgi(self):
+        response = self.client.get(f'/api/chats/{self.chat.id}/export/')
+        self.assertFalse(response.is_async)
+        self.assertEqual(len(list(response.streaming_content)), 2)
+
+    def test_export_requires_participation(self):
+        outsider = User.objects.create_user(username='carol', password='pw-carol-123')
+        self.client.force_login(outsider)
+        response = self.client.get(f'/api/chats/{self.chat.id}/export/')
+        self.assertEqual(response.status_code, 404)
+
+
+class ImportHistoryTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='pw-alice-123')
+        self.bob = User.objects.create_user(username='bob', password='pw-bob-123')
+        tmp = tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False)
+        self.addCleanup(os.remove, tmp.name)
+        with tmp:
+            for sender, content in [('alice', 'one'), ('bob', 'two'), ('alice', 'three')]:
+                tmp.write(json.dumps({
+                    'chat': 'legacy-1', 'sender': sender, 'participants': ['alice', 'bob'],
+                    'content': content, 'timestamp': '2020-05-01T12:00:00Z',
+                }) + '\n')
+        self.path = tmp.name
+
+    def test_import_is_resumable(self):
+        call_command('import_history', self.path, batch_size=1, stdout=io.StringIO())
+        state = HistoryImport.objects.get()
+        self.assertEqual(state.records, 3)
+        self.assertIsNotNone(state.completed_at)
+
+        # Rewind to the checkpoint of a run interrupted after the first record
+        state.completed_at = None
+        state.records = 1
+        with open(self.path, 'rb') as fh:
+            fh.readline()
+            state.position = fh.tell()
+        state.save()
+        Message.objects.exclude(content='one').delete()
+
+        call_command('import_history', self.path, stdout=io.StringIO())
+        chat, created = Chat.objects.get_or_create_direct(self.alice, self.bob)
+        self.assertFalse(created)
+        self.assertEqual(list(chat.messages.values_list('content', flat=True)), ['one', 'two', 'three'])
+
+    def write_dump(self, records):
+        tmp = tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False)
+        self.addCleanup(os.remove, tmp.name)
+        with tmp:
+            for chat, sender, content in records:
+                tmp.write(json.dumps({
+                    'chat': chat, 'sender': sender, 'content': content, 'timestamp': '2020-05-01T12:00:00Z',
+                }) + '\n')
+        return tmp.name
+
+    def test_chat_without_participants_field_is_imported_as_group(self):
+        path = self.write_dump([('dm1', 'alice', 'hi bob'), ('dm1', 'bob', 'hi alice')])
+        call_command('import_history', path, batch_size=1, stdout=io.StringIO())
+
+        chat = Chat.objects.get(messages__content='hi bob')
+        self.assertTrue(chat.is_group)
+        self.assertIsNone(chat.direct_user_low_id)
+        self.assertEqual(chat.messages.count(), 2)
+        self.assertEqual(Chat.objects.filter(is_group=False).count(), 0)
+
+    def test_third_member_of_direct_chat_stops_import(self):
+        call_command('import_history', self.path, stdout=io.StringIO())
+        User.objects.create_user(username='carol', password='pw-carol-123')
+        path = self.write_dump([('legacy-1', 'carol', 'me too')])
+        with self.assertRaises(CommandError):
+            call_command('import_history', path, stdout=io.StringIO())
+        self.assertFalse(Message.objects.filter(content='me too').exists())
+
+    def test_chat_keys_are_shared_across_files(self):
+        first = self.write_dump([('g1', 'alice', 'part one')])
+        second = self.write_dump([('g1', 'bob', 'part two')])
+        call_command('import_history', first, stdout=io.StringIO())
+        call_command('import_history', second, stdout=io.StringIO())
+        chat = Chat.objects.get(messages__content='part one')
+        self.assertEqual(list(chat.messages.values_list('content', flat=True)), ['part one', 'part two'])
+
+    def test_restart_asks_before_duplicating(self):
+        call_command('import_history', self.path, stdout=io.StringIO())
+        with patch('builtins.input', return_value='no'):
+            with self.assertRaises(CommandError):
+                call_command('import_history', self.path, restart=True, stdout=io.StringIO())
+        self.assertEqual(Message.objects.count(), 3)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+class PrimaryReplicaRouterTest(TestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_use_primary_outside_routed_code(self):
+        self.assertEqual(self.router.db_for_read(Message), 'default')
+
+    def test_reads_follow_writes_to_primary(self):
+        with routing():
+            self.assertEqual(self.router.db_for_read(Message), 'replica_0')
+            self.assertEqual(self.router.db_for_write(Message), 'default')
+            self.assertEqual(self.router.db_for_read(Message), 'default')
+        with routing(force_primary=True):
+            self.assertEqual(self.router.db_for_read(Message), 'default')
+
+    @override_settings(DATABASE_REPLICAS=['replica_0', 'replica_1'])
+    def test_one_replica_per_routing_block(self):
+        with routing():
+            replicas = {self.router.db_for_read(Message) for _ in range(20)}
+        self.assertEqual(len(replicas), 1)
+
+    def test_consumer_write_pins_user_everywhere(self):
+        user = User.objects.create_user(username='alice', password='pw-alice-123')
+        consumer = ConsumerRouting()
+        consumer.scope = {'user': user}
+        cache.clear()  # pins left by earlier requests for a reused user id
+        self.addCleanup(cache.clear)
+        self.assertFalse(user_is_pinned(user))
+        with consumer.db_routing():
+            self.router.db_for_write(Message)
+        self.assertTrue(user_is_pinned(user))
+        with consumer.db_routing():
+            self.assertEqual(self.router.db_for_read(Message), 'default')
+
+
+@override_settings(LAST_SEEN_FLUSH_INTERVAL=3600)
+class ReadYourWritesMiddlewareTest(TestCase):
+    def test_write_sets_pin_cookie(self):
+        user = User.objects.create_user(username='alice', password='pw-alice-123')
+        self.addCleanup(cache.clear)
+        self.client.force_login(user)
+        response = self.client.post('/api/chats/start-group/', {'usernames': ['alice']}, content_type='application/json')
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        User.objects.create_user(username='bob', password='pw-bob-123')
+        response = self.client.post('/api/chats/start-group/', {'usernames': ['bob']}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertTrue(user_is_pinned(user))
+
+
+class DbPoolViewTest(TestCase):
+    def test_requires_staff(self):
+        user = User.objects.create_user(username='alice', password='pw-alice-123')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/api/db-pool/').status_code, 403)
+        user.is_staff = True
+        user.save()
+        response = self.client.get('/api/db-pool/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.json(), dict)
+
+    def test_reports_pool_utilization(self):
+        user = User.objects.create_user(username='root', password='pw-root-123', is_staff=True)
+        self.client.force_login(user)
+        pool = Mock(max_size=20)
+        pool.get_stats.return_value = {
+            'pool_size': 10, 'pool_available': 4, 'requests_num': 8, 'requests_wait_ms': 40,
+        }
+        with patch('chat.views.connections', {'default': Mock(vendor='postgresql', pool=pool)}):
+            stats = self.client.get('/api/db-pool/').json()['default']
+        self.assertEqual(stats['in_use'], 6)
+        self.assertEqual(stats['utilization'], 0.3)
+        self.assertEqual(stats['avg_wait_ms'], 5)
+        self.assertEqual(stats['pool_size'], 10)
+
+
+class AttachmentTest(TestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+        settings_override = override_settings(ATTACHMENT_ROOT=root.name, ATTACHMENT_SENDFILE_HEADER='')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.alice = User.objects.create_user(username='alice', password='pw-alice-123')
+        self.bob = User.objects.create_user(username='bob', password='pw-bob-123')
+        self.chat, _ = Chat.objects.get_or_create_direct(self.alice, self.bob)
+        self.client.force_login(self.alice)
+
+    def upload(self, attachment_id, offset, data):
+        return self.client.patch(
+            f'/api/attachments/{attachment_id}/upload/', data,
+            content_type='application/offset+octet-stream', headers={'Upload-Offset': str(offset)},
+        )
+
+    def test_resumable_upload_and_range_download(self):
+        content = b'0123456789abcdef'
+        response = self.client.post('/api/attachments/', {
+            'chat': self.chat.id, 'filename': '../notes.txt', 'content_type': 'text/plain', 'size': len(content),
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        attachment_id = response.json()['id']
+        attachment = Attachment.objects.get(id=attachment_id)
+        self.assertEqual(attachment.filename, 'notes.txt')
+        self.assertTrue(attachment.file.path.startswith(self.root))
+
+        self.assertEqual(self.upload(attachment_id, 0, content[:6]).json()['received'], 6)
+        conflict = self.upload(attachment_id, 0, content[:6])
+        self.assertEqual(conflict.status_code, 409)
+        self.assertEqual(conflict.json()['received'], 6)
+        self.assertTrue(self.upload(attachment_id, 6, content[6:]).json()['completed'])
+
+        self.client.force_login(self.bob)
+        url = f'/api/attachments/{attachment_id}/download/'
+        full = self.client.get(url)
+        self.assertTrue(full.is_async)
+        self.assertEqual(read_stream(full), content)
+        partial = self.client.get(url, headers={'Range': 'bytes=4-7'})
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial['Content-Range'], f'bytes 4-7/{len(content)}')
+        self.assertEqual(read_stream(partial), b'4567')
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': full['ETag']}).status_code, 304)
+        self.assertEqual(self.client.get(url, headers={'Range': 'bytes=99-'}).status_code, 416)
+
+    def create_attachment(self, **fields):
+        attachment = Attachment(chat=self.chat, uploader=self.alice, filename='a.txt', size=0, **fields)
+        attachment.file.save('a.txt', ContentFile(b''), save=False)
+        attachment.save()
+        return attachment
+
+    @patch('channels.db.close_old_connections')  # would drop the test transaction's connection
+    def test_attachment_is_linked_once(self, close_old_connections):
+        attachment = self.create_attachment(completed_at=timezone.now())
+        consumer = ChatConsumer()
+        consumer.scope = {'user': self.alice}
+        consumer.chat_id = self.chat.id
+        first = async_to_sync(consumer.save_message)(self.alice.id, 'file', [attachment.id])
+        self.assertEqual(first['attachments'][0]['id'], attachment.id)
+        Message.objects.filter(id=first['id']).delete()
+        self.assertIsNone(async_to_sync(consumer.save_message)(self.alice.id, 'again', [attachment.id]))
+
+    def test_chat_list_preview_leaves_out_attachments(self):
+        message = Message.objects.create(chat=self.chat, sender=self.alice, content='file')
+        self.create_attachment(completed_at=timezone.now(), linked_at=timezone.now(), message=message)
+        response = self.client.get('/api/chats/')
+        self.assertEqual(response.json()[0]['last_message']['content'], 'file')
+        self.assertNotIn('attachments', response.json()[0]['last_message'])
+
+    def test_files_are_removed_with_their_attachments(self):
+        path = self.create_attachment().file.path
+        self.chat.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_cleanup_removes_unsent_and_orphaned_attachments(self):
+        stale = self.create_attachment()
+        Attachment.objects.filter(id=stale.id).update(created_at=timezone.now() - timedelta(days=2))
+        orphaned = self.create_attachment(completed_at=timezone.now(), linked_at=timezone.now())
+        fresh = self.create_attachment()
+        message = Message.objects.create(chat=self.chat, sender=self.alice, content='file')
+        sent = self.create_attachment(completed_at=timezone.now(), linked_at=timezone.now(), message=message)
+
+        call_command('cleanup_attachments', stdout=io.StringIO())
+        self.assertEqual(set(Attachment.objects.values_list('id', flat=True)), {fresh.id, sent.id})
+        self.assertFalse(os.path.exists(stale.file.path))
+        self.assertFalse(os.path.exists(orphaned.file.path))
+
+
+class LargeTableAdminTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='root', password='pw-root-123')
+        self.alice = User.objects.create_user(username='alice', password='pw-alice-123')
+        self.chat, _ = Chat.objects.get_or_create_direct(self.admin, self.alice)
+        self.messages = [
+            Message.objects.create(chat=self.chat, sender=self.alice, content=f'message {i}') for i in range(5)
+        ]
+        self.client.force_login(self.admin)
+
+    @patch.object(MessageAdmin, 'list_per_page', 2)
+    def test_message_changelist_pages_by_cursor(self):
+        url = '/admin/chat/message/'
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual([m.pk for m in first.context['cl'].result_list], [m.pk for m in self.messages[:-3:-1]])
+        next_cursor = first.context['cl'].next_cursor
+
+        second = self.client.get(url, {'cursor': next_cursor, 'sender__id__exact': self.alice.pk})
+        self.assertEqual([m.pk for m in second.context['cl'].result_list], [m.pk for m in self.messages[2:0:-1]])
+        self.assertContains(second, 'First page')
+
+    def test_chat_changelist_and_change_form(self):
+        self.assertEqual(self.client.get('/admin/chat/chat/').status_code, 200)
+        response = self.client.get(f'/admin/chat/chat/{self.chat.pk}/change/')
+        self.assertContains(response, 'admin-autocomplete')
+
+    def test_chat_filter_rejects_non_numeric_id(self):
+        response = self.client.get('/admin/chat/message/', {'chat__id__exact': 'abc'})
+        self.assertRedirects(response, '/admin/chat/message/?e=1', fetch_redirect_response=False)
+
+    def test_chat_autocomplete_finds_direct_chats_by_id(self):
+        response = self.client.get('/admin/autocomplete/', {
+            'app_label': 'chat', 'model_name': 'message', 'field_name': 'chat', 'term': str(self.chat.pk),
+        })
+        self.assertEqual([result['id'] for result in response.json()['results']], [str(self.chat.pk)])
+
+
+class SendDigestsTest(TestCase):
+    def setUp(self):
+        last_seen.flush()
+        self.alice = User.objects.create_user(username='alice', password='pw-alice-123', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', password='pw-bob-123', email='bob@example.com')
+        self.carol = User.objects.create_user(username='carol', password='pw-carol-123', email='carol@example.com')
+        hour_ago = timezone.now() - timedelta(hours=1)
+        Profile.objects.filter(user=self.bob).update(last_seen=hour_ago)
+        Profile.objects.filter(user__in=[self.alice, self.carol]).update(last_seen=timezone.now())
+        self.chat, _ = Chat.objects.get_or_create_direct(self.alice, self.bob)
+        group = Chat.objects.create(name='Team', is_group=True)
+        group.participants.add(self.alice, self.bob, self.carol)
+        for i in range(5):
+            Message.objects.create(chat=group, sender=self.alice, content=f'group {i}')
+        Message.objects.create(chat=self.chat, sender=self.alice, content='are you there?')
+        Message.objects.create(chat=self.chat, sender=self.bob, content='own message')
+
+    def test_sends_one_digest_per_offline_user(self):
+        out = io.StringIO()
+        call_command('send_digests', once=True, email_backend='locmem', stdout=out)
+
+        # alice and carol are online
+        self.assertEqual([email.to for email in mail.outbox], [['bob@example.com']])
+        body = mail.outbox[0].body
+        self.assertEqual(mail.outbox[0].subject, '6 unread messages')
+        self.assertIn('Team (5 new)', body)
+        self.assertIn('...and 2 more', body)
+        self.assertIn('are you there?', body)
+        self.assertNotIn('own message', body)
+        self.assertIn('digests=1 failed=0 messages=6 batches=1', out.getvalue())
+
+        call_command('send_digests', once=True, email_backend='locmem', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failed_send_only_skips_that_user(self):
+        Profile.objects.filter(user=self.carol).update(last_seen=timezone.now() - timedelta(hours=1))
+        original = locmem.EmailBackend.send_messages
+
+        def send_messages(backend, messages):
+            if messages[0].to == ['bob@example.com']:
+                raise OSError('connection reset')
+            return original(backend, messages)
+
+        out = io.StringIO()
+        with patch.object(locmem.EmailBackend, 'send_messages', send_messages), self.assertLogs('chat', 'ERROR'):
+            call_command('send_digests', once=True, email_backend='locmem', stdout=out)
+        self.assertEqual([email.to for email in mail.outbox], [['carol@example.com']])
+        self.assertIn('digests=1 failed=1', out.getvalue())
+        self.assertIsNone(Profile.objects.get(user=self.bob).digest_sent_at)
+        self.assertIsNotNone(Profile.objects.get(user=self.carol).digest_sent_at)
+
+
+    @override_settings(LAST_SEEN_FLUSH_INTERVAL=3600)
+    def test_connected_reader_is_not_offline(self):
+        consumer = ChatConsumer()
+        consumer.scope = {'user': self.bob}
+        consumer.send = AsyncMock()
+        async_to_sync(consumer.chat_message)({
+            'message_id': 1, 'username': 'alice', 'message': 'are you there?', 'timestamp': '', 'attachments': [],
+        })
+        consumer.send.assert_awaited_once()
+        last_seen.flush()
+
+        call_command('send_digests', once=True, email_backend='locmem', stdout=io.StringIO())
+        self.assertEqual(mail.outbox, [])
+
+    def test_daemon_keeps_running_after_a_failed_run(self):
+        with patch.object(SendDigestsCommand, 'run_once', side_effect=[DatabaseError('gone'), None]) as run_once, \
+                patch.object(send_digests.time, 'sleep', side_effect=[None, KeyboardInterrupt]), \
+                self.assertLogs('chat', 'ERROR'):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command('send_digests', interval=1, stdout=io.StringIO())
+        self.assertEqual(run_once.call_count, 2)
+
+
+class UnixSocketChannelLayerTest(SimpleTestCase):
+    def setUp(self):
+        socket_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(socket_dir.cleanup)
+        self.socket_dir = socket_dir.name
+
+    async def test_group_send_reaches_sibling_layer(self):
+        first = UnixSocketChannelLayer(self.socket_dir, name='first')
+        second = UnixSocketChannelLayer(self.socket_dir, name='second')
+        channel = await second.new_channel()
+        await second.group_add('chat_1', channel)
+
+        await first.group_send('chat_1', {'type': 'chat_message', 'message': 'hi'})
+        message = await asyncio.wait_for(second.receive(channel), timeout=2)
+        self.assertEqual(message['message'], 'hi')
+        await first.flush()
+        await second.flush()
+        self.assertEqual(os.listdir(self.socket_dir), [])
+
+    async def test_large_group_message_is_spooled_to_a_file(self):
+        first = UnixSocketChannelLayer(self.socket_dir, name='first')
+        second = UnixSocketChannelLayer(self.socket_dir, name='second')
+        channel = await second.new_channel()
+        await second.group_add('chat_1', channel)
+
+        text = 'x' * (2 * UnixSocketChannelLayer.max_datagram_size)
+        await first.group_send('chat_1', {'type': 'chat_message', 'message': text})
+        message = await asyncio.wait_for(second.receive(channel), timeout=2)
+        self.assertEqual(message['message'], text)
+        await first.flush()
+        await second.flush()
+
+    async def test_stale_socket_is_removed(self):
+        stale_path = os.path.join(self.socket_dir, '999999.sock')
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        stale.bind(stale_path)
+        stale.close()  # the file stays behind, like a worker that was killed
+
+        layer = UnixSocketChannelLayer(self.socket_dir, name='live')
+        await layer.group_send('chat_1', {'type': 'chat_message', 'message': 'hi'})
+        self.assertFalse(os.path.exists(stale_path))
+        await layer.flush()
+
+    async def test_full_sibling_queue_does_not_block_sender(self):
+        stalled = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        stalled.bind(os.path.join(self.socket_dir, 'stalled.sock'))
+        self.addCleanup(stalled.close)
+
+        layer = UnixSocketChannelLayer(self.socket_dir, name='live')
+        with self.assertLogs('chat.layers', 'WARNING'):
+            for _ in range(1000):
+                await asyncio.wait_for(layer.group_send('chat_1', {'type': 'chat_message', 'message': 'x' * 1000}), 1)
+        await layer.flush()
+
+
+class ServeWorkersTest(SimpleTestCase):
+    def test_rejects_ipv6_host(self):
+        with self.assertRaises(CommandError):
+            call_command('serve_workers', host='::', workers=2)
+
+    def test_backs_off_and_gives_up_on_crashing_worker(self):
+        clock = [0.0]
+        fake_time = Mock(monotonic=lambda: clock[0])
+        fake_time.sleep.side_effect = lambda seconds: clock.__setitem__(0, clock[0] + seconds)
+        starts = []
+
+        def popen(*args, **kwargs):
+            starts.append(clock[0])
+            return Mock(pid=1, returncode=1, **{'poll.return_value': 1})
+
+        with tempfile.TemporaryDirectory() as socket_dir, \
+                patch.object(serve_workers, 'time', fake_time), \
+                patch.object(serve_workers.subprocess, 'Popen', side_effect=popen), \
+                patch.object(serve_workers.signal, 'signal'):
+            with self.assertRaises(CommandError):
+                call_command(
+                    'serve_workers', workers=1, max_restarts=3, socket_dir=socket_dir,
+                    stdout=io.StringIO(), stderr=io.StringIO(),
+                )
+        # Restarted after 1, 2 and 4 seconds, then abandoned
+        self.assertEqual(starts, [0, 2, 5, 10])
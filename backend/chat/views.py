@@ -1,24 +1,37 @@
+import csv
+import itertools
+import json
+import os
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth import authenticate, get_user_model, login, logout
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action, api_view, permission_classes
 from django.views.decorators.csrf import ensure_csrf_cookie
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.exceptions import PermissionDenied, ValidationError
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils._os import safe_join
 from django.conf import settings
 from django.core.mail import send_mail
 from .forms import ContactForm, RegistrationForm
 
-from .models import Chat, Message, Profile
+from .files import BLOCK_SIZE, ranged_file_response
+from .models import Attachment, Chat, Message, Profile
 from .serializers import (
+    AttachmentSerializer,
     ChatCreateSerializer,
     ChatSerializer,
     UserSerializer,
     MessageSerializer,
     ProfileSerializer,
 )
+from django.db import connections, transaction
 from django.db.models import Q
 
 User = get_user_model()
@@ -92,22 +105,46 @@ class ChatViewSet(viewsets.ModelViewSet):
         except User.DoesNotExist:
             return Response({'detail': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
 
-        chat = (
-            Chat.objects.filter(is_group=False, participants=request.user)
-            .filter(participants=target_user)
-            .first()
-        )
-        created = False
-        if chat is None:
-            chat = Chat.objects.create(is_group=False)
-            chat.participants.add(request.user, target_user)
-            created = True
+        chat, created = Chat.objects.get_or_create_direct(request.user, target_user)
 
         chat = Chat.objects.prefetch_related('participants', 'participants__profile').get(id=chat.id)
         serializer = ChatSerializer(chat, context={'request': request})
         status_code = status.HTTP_201_CREATED if created else status.HTTP_200_OK
         return Response(serializer.data, status=status_code)
 
+    @action(detail=True, methods=['get'], url_path='export')
+    def export(self, request, pk=None):
+        """
+        Stream the full message history of a chat as NDJSON (default) or CSV.
+
+        Query params:
+          - type: "ndjson" or "csv"
+
+        Rows come from a server-side cursor and are sent in blocks, so memory
+        use does not grow with the history. Under ASGI the body must be an
+        async generator (Django's ASGI handler would collect a sync iterator
+        into a list first) and under WSGI a sync one (the WSGI handler does the
+        same to an async iterator), so the body matches the server.
+        """
+        export_type = request.query_params.get('type', 'ndjson').lower()
+        if export_type not in ('ndjson', 'csv'):
+            return Response({'detail': 'type must be "ndjson" or "csv".'}, status=status.HTTP_400_BAD_REQUEST)
+        chat = self.get_object()
+        rows = (
+            Message.objects.filter(chat_id=chat.id)
+            .order_by('timestamp', 'id')
+            .values_list('id', 'sender__username', 'content', 'timestamp')
+        )
+        header, format_row = _export_format(export_type)
+        if _served_over_asgi(request):
+            content = _achunked(_aiter_rows(rows, EXPORT_CHUNK_SIZE), header, format_row)
+        else:
+            content = _chunked(rows.iterator(chunk_size=EXPORT_CHUNK_SIZE), header, format_row)
+        content_type = 'text/csv' if export_type == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="chat-{chat.id}.{export_type}"'
+        return response
+
     @action(detail=False, methods=['post'], url_path='start-group')
     def start_group(self, request):
         """
@@ -151,6 +188,68 @@ class ChatViewSet(viewsets.ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+EXPORT_CHUNK_SIZE = 2000
+
+
+class _Echo:
+    """File-like object whose write() returns the value instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+async def _aiter_rows(queryset, chunk_size):
+    """Async iteration over a server-side cursor, ``chunk_size`` rows per thread hop.
+
+    ``QuerySet.aiterator()`` runs ``values_list()`` queries in the event loop
+    and raises SynchronousOnlyOperation, so drive ``iterator()`` directly.
+    """
+    rows = queryset.iterator(chunk_size=chunk_size)
+    next_chunk = sync_to_async(lambda: list(itertools.islice(rows, chunk_size)))
+    while chunk := await next_chunk():
+        for row in chunk:
+            yield row
+
+
+def _served_over_asgi(request) -> bool:
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+def _export_format(export_type):
+    """Return the header line and a row formatter for an export type."""
+    if export_type == 'csv':
+        writer = csv.writer(_Echo())
+        header = writer.writerow(['id', 'sender', 'content', 'timestamp'])
+        return header, lambda row: writer.writerow([row[0], row[1], row[2], row[3].isoformat()])
+    return '', lambda row: json.dumps(
+        {'id': row[0], 'sender': row[1], 'content': row[2], 'timestamp': row[3].isoformat()}
+    ) + '\n'
+
+
+def _chunked(rows, header, format_row):
+    """Format rows and join them into blocks so each yield carries many rows."""
+    block = [header] if header else []
+    for row in rows:
+        block.append(format_row(row))
+        if len(block) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(block)
+            block = []
+    if block:
+        yield ''.join(block)
+
+
+async def _achunked(rows, header, format_row):
+    """Async counterpart of ``_chunked``."""
+    block = [header] if header else []
+    async for row in rows:
+        block.append(format_row(row))
+        if len(block) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(block)
+            block = []
+    if block:
+        yield ''.join(block)
+
+
 class UserSearchViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = User.objects.select_related('profile').all()
     serializer_class = UserSerializer
@@ -176,7 +275,7 @@ class MessageViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, viewsets.Ge
         if not chat_id:
             raise ValidationError('Query parameter "chat" is required.')
         chat = get_object_or_404(Chat, id=chat_id, participants=self.request.user)
-        return chat.messages.select_related('sender').order_by('timestamp')
+        return chat.messages.select_related('sender').prefetch_related('attachments').order_by('timestamp')
 
     def perform_create(self, serializer):
         chat_id = self.request.data.get('chat')
@@ -188,6 +287,78 @@ class MessageViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, viewsets.Ge
         serializer.save(chat=chat, sender=self.request.user)
 
 
+class AttachmentViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    Resumable chunked uploads and range-capable downloads of chat attachments.
+
+    1. POST /api/attachments/ with chat, filename, content_type and size.
+    2. PATCH /api/attachments/<id>/upload/ with the raw bytes as the body and an
+       Upload-Offset header equal to the bytes already received. Repeat until
+       received == size. After an interruption, GET /api/attachments/<id>/
+       returns the offset to continue from.
+    3. Reference the attachment id when sending a message.
+    """
+
+    serializer_class = AttachmentSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Attachment.objects.filter(chat__participants=self.request.user)
+
+    @action(detail=True, methods=['patch'], url_path='upload')
+    def upload(self, request, pk=None):
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return Response({'detail': 'Upload-Offset header is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            attachment = get_object_or_404(
+                self.get_queryset().select_for_update(), pk=pk, uploader=request.user,
+            )
+            if attachment.completed_at is not None:
+                return Response({'detail': 'Upload already completed.'}, status=status.HTTP_409_CONFLICT)
+            if offset != attachment.received:
+                return Response(
+                    {'detail': 'Offset mismatch.', 'received': attachment.received},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            remaining = attachment.size - offset
+            # Copy the request body in blocks; it is never held in memory as a whole
+            with open(attachment.file.path, 'r+b') as fh:
+                fh.seek(offset)
+                while True:
+                    block = request.stream.read(BLOCK_SIZE) if request.stream else b''
+                    if not block:
+                        break
+                    if len(block) > remaining:
+                        return Response(
+                            {'detail': 'Upload exceeds the declared size.', 'received': attachment.received},
+                            status=status.HTTP_400_BAD_REQUEST,
+                        )
+                    fh.write(block)
+                    remaining -= len(block)
+                    attachment.received += len(block)
+                fh.truncate(attachment.received)
+            if attachment.received == attachment.size:
+                attachment.completed_at = timezone.now()
+            attachment.save(update_fields=['received', 'completed_at'])
+        return Response(self.get_serializer(attachment).data)
+
+    @action(detail=True, methods=['get'], url_path='download')
+    def download(self, request, pk=None):
+        attachment = self.get_object()
+        if attachment.completed_at is None:
+            raise Http404('Attachment upload is not complete.')
+        return ranged_file_response(
+            request,
+            attachment.file.path,
+            content_type=attachment.content_type or None,
+            filename=attachment.filename,
+            as_attachment=True,
+            sendfile_path=settings.ATTACHMENT_SENDFILE_PREFIX + attachment.file.name,
+        )
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def login_view(request):
@@ -234,6 +405,43 @@ def session_view(request):
     return Response({'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_401_UNAUTHORIZED)
 
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def db_pool_view(request):
+    """Report connection pool size, utilization and wait time per database alias.
+
+    Pools live in each process, so under ``serve_workers`` the numbers cover
+    only the worker that answered this request.
+    """
+    pools = {}
+    for alias in connections:
+        connection = connections[alias]
+        pool = connection.pool if connection.vendor == 'postgresql' else None
+        if pool is None:
+            continue
+        stats = pool.get_stats()
+        in_use = stats.get('pool_size', 0) - stats.get('pool_available', 0)
+        requests = stats.get('requests_num', 0)
+        pools[alias] = {
+            **stats,
+            'in_use': in_use,
+            'utilization': in_use / pool.max_size if pool.max_size else 0,
+            'avg_wait_ms': stats.get('requests_wait_ms', 0) / requests if requests else 0,
+        }
+    return Response(pools)
+
+
+def media_view(request, path):
+    """Serve MEDIA_ROOT files with ETag and Range support during development."""
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except ValueError:
+        raise Http404('Invalid path.')
+    if not os.path.isfile(full_path):
+        raise Http404('File not found.')
+    return ranged_file_response(request, full_path)
+
+
 def index(request):
     """Simple homepage view."""
     return render(request, 'index.html')
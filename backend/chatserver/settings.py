@@ -30,6 +30,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'chat.middleware.LastSeenMiddleware',
+    'chat.db_router.ReadYourWritesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -67,6 +69,49 @@ DATABASES = {
     }
 }
 
+# Pooled connections (psycopg 3 + psycopg_pool). Each consumer/view DB call checks a
+# connection out and Django returns it to the pool when the call finishes, instead of
+# every executor thread holding its own persistent connection.
+if os.environ.get('POSTGRES_POOL', 'False') == 'True':
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.environ.get('POSTGRES_POOL_MAX_SIZE', '20')),
+            # Seconds to wait for a free connection before raising PoolTimeout
+            'timeout': float(os.environ.get('POSTGRES_POOL_TIMEOUT', '10')),
+        },
+    }
+
+# Read replicas as comma-separated host[:port] entries, e.g. "127.0.0.1:5433,127.0.0.1:5434"
+DATABASE_REPLICAS = []
+for _index, _address in enumerate(filter(None, os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(','))):
+    _host, _, _port = _address.strip().partition(':')
+    DATABASES[f'replica_{_index}'] = {
+        **DATABASES['default'],
+        'HOST': _host,
+        'PORT': _port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{_index}')
+
+DATABASE_ROUTERS = ['chat.db_router.PrimaryReplicaRouter']
+# Seconds a user keeps reading from the primary after they write
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', '5'))
+
+# Holds the per-user replica pins; set REDIS_URL so every worker and host shares them
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+
+# Seconds between bulk writes of buffered last_login / last_seen timestamps (0 = write through)
+LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('LAST_SEEN_FLUSH_INTERVAL', '30'))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -94,6 +139,14 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Chat attachments live outside MEDIA_ROOT and are served by an access-checked view
+ATTACHMENT_ROOT = Path(os.environ.get('ATTACHMENT_ROOT', BASE_DIR / 'attachments'))
+ATTACHMENT_MAX_SIZE = int(os.environ.get('ATTACHMENT_MAX_SIZE', str(100 * 1024 * 1024)))
+# Hand file bodies to the front-end server, e.g. "X-Accel-Redirect" (nginx) or "X-Sendfile"
+ATTACHMENT_SENDFILE_HEADER = os.environ.get('ATTACHMENT_SENDFILE_HEADER', '')
+# URL prefix (X-Accel-Redirect) or filesystem root (X-Sendfile) the front-end maps to ATTACHMENT_ROOT
+ATTACHMENT_SENDFILE_PREFIX = os.environ.get('ATTACHMENT_SENDFILE_PREFIX', '/protected-attachments/')
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
@@ -111,6 +164,12 @@ CHANNEL_LAYERS = {
         'BACKEND': 'channels.layers.InMemoryChannelLayer',
     }
 }
+# Set by `manage.py serve_workers` so group messages reach every worker process
+if os.environ.get('CHANNEL_LAYER_SOCKET_DIR'):
+    CHANNEL_LAYERS['default'] = {
+        'BACKEND': 'chat.layers.UnixSocketChannelLayer',
+        'CONFIG': {'socket_dir': os.environ['CHANNEL_LAYER_SOCKET_DIR']},
+    }
 
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:3000',
@@ -121,7 +180,9 @@ CORS_ALLOW_CREDENTIALS = True
 CSRF_TRUSTED_ORIGINS = ['http://localhost:3000']
 
 # Use console email backend so `send_mail` output appears in the server console for testing
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+# Used by django.core.mail.backends.filebased.EmailBackend (e.g. `send_digests --email-backend file`)
+EMAIL_FILE_PATH = BASE_DIR / 'sent_emails'
 DEFAULT_FROM_EMAIL = 'admin@webchat.com'
 
 # Redirects for auth views
@@ -1,9 +1,10 @@
+import re
+
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
 from rest_framework import routers
 from chat import views
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views
 
 router = routers.DefaultRouter()
@@ -11,6 +12,7 @@ router.register(r'users', views.UserSearchViewSet, basename='user')
 router.register(r'chats', views.ChatViewSet, basename='chat')
 router.register(r'messages', views.MessageViewSet, basename='message')
 router.register(r'profiles', views.ProfileViewSet, basename='profile')
+router.register(r'attachments', views.AttachmentViewSet, basename='attachment')
 
 urlpatterns = [
     path('', views.index, name='home'),
@@ -19,6 +21,7 @@ urlpatterns = [
     path('api/auth/logout/', views.logout_view, name='api-logout'),
     path('api/auth/register/', views.register_view, name='api-register'),
     path('api/auth/session/', views.session_view, name='api-session'),
+    path('api/db-pool/', views.db_pool_view, name='api-db-pool'),
     path('api/', include(router.urls)),
     path('api/auth/', include('rest_framework.urls')),
     # Authentication views (login/logout) using built-in class-based views
@@ -26,5 +29,11 @@ urlpatterns = [
     path('accounts/logout/', auth_views.LogoutView.as_view(), name='logout'),
     path('accounts/register/', views.register_user, name='register'),
     path('send-email/', views.send_email_view, name='send-email'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
+
+if settings.DEBUG:
+    # Like django.conf.urls.static.static(), but with Range/ETag support
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), views.media_view),
+    ]
 
@@ -12,6 +12,11 @@ fi
 echo "Running migrations..."
 python manage.py migrate --noinput
 
+if [ "${WEB_WORKERS:-1}" -gt 1 ]; then
+  echo "Starting $WEB_WORKERS Daphne workers..."
+  exec python manage.py serve_workers --host 0.0.0.0 --port 8000 --workers "$WEB_WORKERS"
+fi
+
 echo "Starting Daphne..."
 exec daphne -b 0.0.0.0 -p 8000 chatserver.asgi:application
 